@@ -1,17 +1,35 @@
-from flask import Flask, request, redirect, url_for, session, jsonify, render_template, flash
-from flask_session import Session
+from flask import Flask, Response, request, redirect, url_for, session, jsonify, render_template, flash, stream_with_context
 from dotenv import load_dotenv
 import os
 import csv
-from io import TextIOWrapper
-import time
+import json
+import uuid
 from nylas import Client
 from nylas.models.auth import URLForAuthenticationConfig, CodeExchangeRequest
 from openai import OpenAI
 from datetime import datetime, timedelta
-from models import db, Recipient, Campaign
-from apscheduler.schedulers.background import BackgroundScheduler
+import metrics
+import resilience
+from database import database_uri, engine_options, init_database
+from models import db, upgrade_schema, Job, Recipient, Campaign, CampaignVariant, Segment, Suppression
+from sender import CampaignDispatcher, spread_send_times
+from importer import bulk_upsert_recipients, iter_csv_rows, iter_contact_rows, normalize_email
+from ledger import seed_deliveries, reset_deliveries, count_undelivered, delivery_counts, iter_pending, DeliveryRecorder
+from jobs import JobQueue
+from categorizer import categorize_messages, iter_messages
+from llm import LLMGateway
+from message_store import MessageStore
+from email_text import truncate_tokens
+from suppression import SUPPRESSION_REASONS, SuppressionList
+from segments import build_rule, create_segment, add_members, audience_condition, audience_size
+from exports import csv_response, iter_recipient_rows, iter_delivery_rows, RECIPIENT_HEADER, DELIVERY_HEADER
+from pagination import page_size, keyset_page, search_recipients
+from personalize import MERGE_FIELD_INSTRUCTIONS, CampaignRenderer, iter_recipients, largest_segments, generate_segment_variants
+from sessions import DatabaseSessionInterface
+from scheduling import job_target, run_job, create_scheduler, LeaderLease, SchedulerSupervisor
+from apscheduler.events import EVENT_JOB_MISSED
 from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import update
 
 
 
@@ -19,30 +37,105 @@ from apscheduler.triggers.cron import CronTrigger
 load_dotenv()
 
 # Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Retries are handled by LLMGateway (see resilience.py), not the client
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///email_assistant.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(seconds=int(os.environ.get("SESSION_LIFETIME", 7 * 24 * 3600)))  # server-side expiry
+app.config["SESSION_SWEEP_INTERVAL"] = int(os.environ.get("SESSION_SWEEP_INTERVAL", 15 * 60))  # seconds
+app.config["CAMPAIGN_SEND_WORKERS"] = int(os.environ.get("CAMPAIGN_SEND_WORKERS", 8))
+app.config["CAMPAIGN_SEND_RATE"] = float(os.environ.get("CAMPAIGN_SEND_RATE", 10))  # messages/second per grant
+app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"] = int(os.environ.get("CAMPAIGN_MAX_DELIVERY_ATTEMPTS", 5))
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 4))
+app.config["JOB_TIMEOUT"] = int(os.environ.get("JOB_TIMEOUT", 6 * 3600))  # seconds before a 'running' job counts as dead
+app.config["CATEGORIZE_MESSAGE_LIMIT"] = int(os.environ.get("CATEGORIZE_MESSAGE_LIMIT", 100))
+app.config["CATEGORIZE_BATCH_SIZE"] = int(os.environ.get("CATEGORIZE_BATCH_SIZE", 20))
+app.config["CATEGORIZE_WORKERS"] = int(os.environ.get("CATEGORIZE_WORKERS", 4))
+app.config["LLM_CACHE_TTL"] = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))  # seconds
+app.config["LLM_CACHE_MAX_ENTRIES"] = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+app.config["MESSAGE_CACHE_TTL"] = int(os.environ.get("MESSAGE_CACHE_TTL", 60))  # seconds
+app.config["PERSONALIZE_MAX_SEGMENTS"] = int(os.environ.get("PERSONALIZE_MAX_SEGMENTS", 50))
+app.config["PERSONALIZE_WORKERS"] = int(os.environ.get("PERSONALIZE_WORKERS", 4))
+app.config["CAMPAIGN_DELIVERY_WINDOW"] = int(os.environ.get("CAMPAIGN_DELIVERY_WINDOW", 2 * 3600))  # seconds, for pre-staged campaigns
+app.config["CAMPAIGN_STAGE_MIN_LEAD"] = int(os.environ.get("CAMPAIGN_STAGE_MIN_LEAD", 120))  # earliest send_at, seconds from now
+app.config["NYLAS_SEND_AT_MAX_DAYS"] = int(os.environ.get("NYLAS_SEND_AT_MAX_DAYS", 30))  # how far ahead Nylas accepts send_at
+# How late a recurring run or housekeeping job may still fire; one-off campaign sends always fire
+app.config["CAMPAIGN_MISFIRE_GRACE_SECONDS"] = int(os.environ.get("CAMPAIGN_MISFIRE_GRACE_SECONDS", 24 * 3600))
+app.config["SCHEDULER_LEASE_TTL"] = int(os.environ.get("SCHEDULER_LEASE_TTL", 30))  # seconds
+app.config["TRACE_REQUESTS"] = os.environ.get("TRACE_REQUESTS", "").lower() in ("1", "true", "yes")
+# Most tokens of the email body each LLM call site may put in its prompt
+app.config["PROMPT_TOKEN_BUDGETS"] = {
+    "generate_response": int(os.environ.get("PROMPT_TOKENS_GENERATE_RESPONSE", 1500)),
+    "generate_refined_response": int(os.environ.get("PROMPT_TOKENS_GENERATE_REFINED_RESPONSE", 1500)),
+    "categorize_batch": int(os.environ.get("PROMPT_TOKENS_CATEGORIZE_BATCH", 100)),  # per message in a batch
+}
+app.config["SUPPRESSION_MAX_EXACT"] = int(os.environ.get("SUPPRESSION_MAX_EXACT", 1_000_000))  # beyond this, bloom filter only
+app.config["SUPPRESSION_REFRESH_INTERVAL"] = int(os.environ.get("SUPPRESSION_REFRESH_INTERVAL", 30))  # seconds
+app.config["DB_BUSY_TIMEOUT"] = float(os.environ.get("DB_BUSY_TIMEOUT", 15))  # seconds a writer waits for the lock
+# Roughly one connection per thread that can touch the database at once
+app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", (
+    app.config["JOB_WORKERS"] + app.config["CATEGORIZE_WORKERS"] + app.config["PERSONALIZE_WORKERS"] + 4
+)))
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+    app.config["SQLALCHEMY_DATABASE_URI"],
+    pool_size=app.config["DB_POOL_SIZE"],
+    busy_timeout=app.config["DB_BUSY_TIMEOUT"],
+)
 db.init_app(app)
+init_database(app, db)
+metrics.init_app(app)
+app.session_interface = DatabaseSessionInterface(app)
 
 
 # Initialize Nylas client
 nylas = Client(
     api_key=os.environ.get("NYLAS_API_KEY"),
-    api_uri=os.environ.get("NYLAS_API_URI"),
+    api_uri=os.environ.get("NYLAS_API_URI", "https://api.us.nylas.com"),
+)
+
+dispatcher = CampaignDispatcher(
+    nylas,
+    workers=app.config["CAMPAIGN_SEND_WORKERS"],
+    rate=app.config["CAMPAIGN_SEND_RATE"],
 )
 
+jobs = JobQueue(app)
+llm = LLMGateway(client, app)
+suppressions = SuppressionList(app)
+
+
+@app.context_processor
+def inject_job():
+    # Pages that kicked off a background job are redirected with ?job_id=...
+    # so base.html can show its progress.
+    job_id = request.args.get("job_id")
+    job = jobs.get(job_id) if job_id else None
+    return {"job": job.to_dict() if job else None}
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/llm/stats", methods=["GET"])
+def llm_stats():
+    return jsonify(llm.stats())
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route("/nylas/manage-recepients", methods=["GET", "POST"])
 def manage_recipients():
     if request.method == "POST":
         name = request.form.get("name")
-        email = request.form.get("email")
+        email = normalize_email(request.form.get("email"))
         if name and email:
             existing_recipient = Recipient.query.filter_by(email=email).first()
             if existing_recipient:
@@ -54,9 +147,37 @@ def manage_recipients():
                 flash("Recipient added successfully", "success")
             db.session.commit()
         else:
-            flash("Name and email are required", "error")
-    recipients = Recipient.query.all()
-    return render_template("manage-recepients.html", recipients=recipients)
+            flash("A name and a valid email are required", "error")
+    q = request.args.get("q", "")
+    recipients, next_cursor = search_recipients(
+        Recipient.query,
+        Recipient,
+        q,
+        after=request.args.get("after", type=int),
+        limit=page_size(request.args.get("limit")),
+    )
+    return render_template("manage-recepients.html", recipients=recipients, next_cursor=next_cursor, q=q)
+
+@app.route("/api/recipients", methods=["GET"])
+def list_recipients():
+    recipients, next_cursor = search_recipients(
+        Recipient.query,
+        Recipient,
+        request.args.get("q"),
+        after=request.args.get("after", type=int),
+        limit=page_size(request.args.get("limit")),
+    )
+    return jsonify({"data": [r.to_dict() for r in recipients], "next_cursor": next_cursor})
+
+@app.route("/nylas/export/recipients.csv", methods=["GET"])
+def export_recipients():
+    segment_id = request.args.get("segment_id", type=int)
+    segment = db.session.get(Segment, segment_id) if segment_id else None
+    if segment_id and segment is None:
+        return jsonify({"error": "Segment not found"}), 404
+    filename = f"recipients-{segment.name}.csv" if segment else "recipients.csv"
+    return csv_response(filename, RECIPIENT_HEADER, iter_recipient_rows(segment),
+                        compress=request.args.get("gzip") == "1")
 
 @app.route("/nylas/import-csv", methods=["POST"])
 def import_csv():
@@ -68,65 +189,167 @@ def import_csv():
         flash('No selected file', 'error')
         return redirect(url_for('manage_recipients'))
     if file and file.filename.endswith('.csv'):
-        csv_file = TextIOWrapper(file, encoding='utf-8')
-        csv_reader = csv.DictReader(csv_file)
-        added_count = 0
-        for row in csv_reader:
-            name = row.get('name', '').strip()
-            email = row.get('email', '').strip()
-            if name and email:
-                existing_recipient = Recipient.query.filter_by(email=email).first()
-                if existing_recipient:
-                    existing_recipient.name = name
-                else:
-                    new_recipient = Recipient(name=name, email=email)
-                    db.session.add(new_recipient)
-                    added_count += 1
-        db.session.commit()
-        flash(f'CSV imported successfully. Added {added_count} recipients.', 'success')
+        upload_dir = os.path.join(app.instance_path, "uploads")
+        os.makedirs(upload_dir, exist_ok=True)
+        path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.csv")
+        file.save(path)
+        job_id = jobs.enqueue("import_csv", path=path)
+        flash('CSV import started.', 'info')
+        return redirect(url_for('manage_recipients', job_id=job_id))
     else:
         flash('Invalid file type. Please upload a CSV file.', 'error')
     return redirect(url_for('manage_recipients'))
 
+@jobs.task("import_csv")
+def import_csv_job(job, path):
+    def report(result):
+        job.update(progress=result.processed, message=f"{result.processed} rows processed")
+
+    try:
+        with open(path, encoding='utf-8', newline='') as csv_file:
+            result = bulk_upsert_recipients(iter_csv_rows(csv_file), progress=report, suppressions=suppressions)
+    finally:
+        os.remove(path)
+    summary = (f"CSV imported successfully. Added {result.inserted}, updated {result.updated}, "
+               f"rejected {result.rejected}, skipped {result.suppressed} suppressed recipients.")
+    return dict(result.as_dict(), summary=summary)
+
 @app.route("/nylas/import-contacts", methods=["POST"])
 def import_contacts():
     if 'grant_id' not in session:
         flash("Please authenticate with Nylas first.", "warning")
         return redirect(url_for('login'))
+    job_id = jobs.enqueue("import_contacts", grant_id=session["grant_id"])
+    flash('Contact import started.', 'info')
+    return redirect(url_for('manage_recipients', job_id=job_id))
+
+@jobs.task("import_contacts")
+def import_contacts_job(job, grant_id):
+    def iter_contacts():
+        query_params = {"limit": 200}
+        while True:
+            response = nylas_retry(nylas.contacts.list, grant_id, query_params)
+            yield from response.data
+            if not response.next_cursor:
+                break
+            query_params["page_token"] = response.next_cursor
+
+    def report(result):
+        job.update(progress=result.processed, message=f"{result.processed} contacts processed")
+
+    result = bulk_upsert_recipients(iter_contact_rows(iter_contacts()), progress=report, suppressions=suppressions)
+    summary = (f"Contacts imported successfully. Added {result.inserted}, updated {result.updated}, "
+               f"rejected {result.rejected}, skipped {result.suppressed} suppressed recipients.")
+    return dict(result.as_dict(), summary=summary)
+
+@app.route("/nylas/suppressions", methods=["GET", "POST"])
+def manage_suppressions():
+    if request.method == "POST":
+        reason = request.form.get("reason", "manual")
+        file = request.files.get("file")
+        if file and file.filename:
+            if not file.filename.endswith('.csv'):
+                flash('Invalid file type. Please upload a CSV file.', 'error')
+                return redirect(url_for('manage_suppressions'))
+            upload_dir = os.path.join(app.instance_path, "uploads")
+            os.makedirs(upload_dir, exist_ok=True)
+            path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.csv")
+            file.save(path)
+            job_id = jobs.enqueue("import_suppressions", path=path, reason=reason, source=file.filename)
+            flash('Suppression import started.', 'info')
+            return redirect(url_for('manage_suppressions', job_id=job_id))
+        emails = request.form.get("emails", "").splitlines()
+        added, rejected = suppressions.add(((email, reason) for email in emails if email.strip()), source="manual")
+        flash(f"Suppressed {added} new addresses, rejected {rejected} invalid ones.", "success")
+        return redirect(url_for('manage_suppressions'))
+    recent = Suppression.query.order_by(Suppression.id.desc()).limit(50).all()
+    return render_template("suppressions.html", suppressions=recent, total=Suppression.query.count(),
+                           reasons=SUPPRESSION_REASONS)
+
+@jobs.task("import_suppressions")
+def import_suppressions_job(job, path, reason, source=None):
+    # CSV with an email column and an optional reason column
     try:
-        contacts, _, _ = nylas.contacts.list(session["grant_id"])
-        for contact in contacts:
-            if contact.emails:
-                for email in contact.emails:
-                    name = f"{contact.given_name} {contact.surname}".strip() or email
-                    existing_recipient = Recipient.query.filter_by(email=email).first()
-                    if existing_recipient:
-                        existing_recipient.name = name
-                    else:
-                        new_recipient = Recipient(name=name, email=email)
-                        db.session.add(new_recipient)
-        db.session.commit()
-        flash("Contacts imported successfully", "success")
-    except Exception as e:
-        flash(f"Error importing contacts: {str(e)}", "error")
-    return redirect(url_for('manage_recipients'))
+        with open(path, encoding='utf-8', newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            if reader.fieldnames:
+                reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+            added, rejected = suppressions.add(
+                ((row.get("email"), row.get("reason") or reason) for row in reader), source=source,
+            )
+    finally:
+        os.remove(path)
+    return {"added": added, "rejected": rejected,
+            "summary": f"Suppressed {added} new addresses, rejected {rejected} invalid ones."}
 
 
-def generate_email_content_bulk(prompt):
+def generate_email_content_bulk(prompt, personalized=False):
+    system_prompt = "You are an email marketing assistant."
+    if personalized:
+        system_prompt += " " + MERGE_FIELD_INSTRUCTIONS
     try:
-        response = client.chat.completions.create(
+        content = llm.complete(
+            "generate_email_content_bulk",
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": "You are an email marketing assistant."},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Create an email for {prompt}"}
             ],
             max_tokens=300,
             temperature=0.7
         )
-        return response.choices[0].message.content.strip()
+        return content
     except Exception as e:
         return f"Error generating email content: {str(e)}"
 
+@app.route("/nylas/segments", methods=["GET", "POST"])
+def manage_segments():
+    if request.method == "POST":
+        name = (request.form.get("name") or "").strip()
+        kind = request.form.get("kind", "list")
+        if not name:
+            flash("Segment name is required", "error")
+        elif Segment.query.filter_by(name=name).first():
+            flash(f"A segment named '{name}' already exists", "error")
+        elif kind == "rule":
+            try:
+                rule = build_rule(
+                    request.form.get("domains"),
+                    request.form.get("created_after"),
+                    request.form.get("created_before"),
+                )
+            except ValueError as e:
+                flash(str(e), "error")
+            else:
+                create_segment(name, "rule", rule)
+                flash(f"Segment '{name}' created", "success")
+        else:
+            segment = create_segment(name, "list")
+            emails = filter(None, (normalize_email(line) for line in request.form.get("emails", "").splitlines()))
+            matched = add_members(segment.id, emails)
+            flash(f"Segment '{name}' created with {matched} recipients", "success")
+        return redirect(url_for('manage_segments'))
+    segments = Segment.query.order_by(Segment.name).all()
+    sizes = {segment.id: audience_size(segment) for segment in segments}
+    return render_template("segments.html", segments=segments, sizes=sizes)
+
+@app.route("/nylas/segments/<int:segment_id>/members", methods=["POST"])
+def add_segment_members(segment_id):
+    segment = db.session.get(Segment, segment_id)
+    if segment is None or segment.kind != "list":
+        flash("Members can only be added to list segments", "error")
+    else:
+        emails = filter(None, (normalize_email(line) for line in request.form.get("emails", "").splitlines()))
+        flash(f"Added {add_members(segment.id, emails)} recipients to '{segment.name}'", "success")
+    return redirect(url_for('manage_segments'))
+
+@app.route("/api/segments", methods=["GET"])
+def list_segments():
+    return jsonify({"data": [
+        dict(segment.to_dict(), size=audience_size(segment))
+        for segment in Segment.query.order_by(Segment.name)
+    ]})
+
 @app.route("/nylas/create-campaign", methods=["GET", "POST"])
 def create_campaign():
     if request.method == "POST":
@@ -135,87 +358,388 @@ def create_campaign():
         prompt = request.form.get("prompt")
         schedule_type = request.form.get("schedule_type")
         schedule_days = request.form.get("schedule_days", type=int)
+        personalization = request.form.get("personalization", "none")
+        segment_id = request.form.get("segment_id") or None
+        window_hours = request.form.get("delivery_window_hours", type=float)
         
-        if name and subject and prompt:
-            body = generate_email_content_bulk(prompt)
-            campaign = Campaign(name=name, subject=subject, body=body)
+        if not (name and subject and prompt):
+            flash("All fields are required", "error")
+        elif segment_id is not None and (not segment_id.isdigit() or db.session.get(Segment, int(segment_id)) is None):
+            # SQLite doesn't enforce the foreign key, and a missing segment
+            # would silently widen the audience to every recipient
+            flash("Unknown audience segment", "error")
+        elif request.form.get("delivery_window_hours") and not (window_hours or 0) > 0:
+            # A window <= 0 would put send_at before scheduled_at
+            flash("Delivery window must be a positive number of hours", "error")
+        else:
+            delivery_window = int(window_hours * 3600) if window_hours else app.config["CAMPAIGN_DELIVERY_WINDOW"]
+            segment_id = int(segment_id) if segment_id else None
+            # The body is generated in the background; the campaign stays in
+            # 'generating' until it is ready.
+            campaign = Campaign(name=name, subject=subject, body="", status='generating', grant_id=session.get("grant_id"),
+                                segment_id=segment_id)
+            final_status = 'draft'
             
             if schedule_type == "once":
                 campaign.scheduled_at = datetime.utcnow() + timedelta(days=schedule_days)
-                campaign.status = 'scheduled'
+                final_status = 'scheduled'
+                if request.form.get("delivery") == "prestage":
+                    campaign.delivery_window = delivery_window
             elif schedule_type == "recurring":
                 # For recurring campaigns, we'll need to implement a more complex scheduling system
                 # For now, let's just set it as 'recurring' in the status
-                campaign.status = 'recurring'
+                final_status = 'recurring'
             
             db.session.add(campaign)
             db.session.commit()
-            flash("Campaign created successfully", "success")
-            return redirect(url_for('view_campaigns'))
-        else:
-            flash("All fields are required", "error")
-    return render_template("create-campaign.html")
+            job_id = jobs.enqueue("generate_campaign", campaign_id=campaign.id, prompt=prompt, status=final_status,
+                                  personalization=personalization)
+            flash("Campaign created. Generating its content...", "success")
+            return redirect(url_for('view_campaigns', job_id=job_id))
+    return render_template("create-campaign.html", segments=Segment.query.order_by(Segment.name).all(),
+                           default_window_hours=app.config["CAMPAIGN_DELIVERY_WINDOW"] / 3600)
+
+def generate_campaign_failed(campaign_id, **params):
+    # Leaves the campaign editable instead of stuck in 'generating'
+    db.session.execute(
+        update(Campaign).where(Campaign.id == campaign_id, Campaign.status == 'generating').values(status='draft')
+    )
+
+@jobs.task("generate_campaign", on_failure=generate_campaign_failed)
+def generate_campaign_job(job, campaign_id, prompt, status, personalization="none"):
+    job.update(message="Generating email content", force=True)
+    body = generate_email_content_bulk(prompt, personalized=personalization != "none")
+    campaign = db.session.get(Campaign, campaign_id)
+    campaign.body = body
+    if personalization == "ai_domain":
+        # One variant per email domain (largest segments first); everyone
+        # outside those segments gets the base body.
+        audience = audience_condition(db.session.get(Segment, campaign.segment_id) if campaign.segment_id else None)
+        segments = largest_segments("domain", limit=app.config["PERSONALIZE_MAX_SEGMENTS"], audience=audience)
+        job.update(message=f"Generating variants for {len(segments)} segments", force=True)
+        variants = generate_segment_variants(llm, prompt, body, segments, workers=app.config["PERSONALIZE_WORKERS"])
+        CampaignVariant.query.filter_by(campaign_id=campaign_id).delete()
+        db.session.add_all(
+            CampaignVariant(campaign_id=campaign_id, segment=segment, body=variant)
+            for segment, variant in variants.items()
+        )
+    campaign.status = status
+    db.session.commit()
+    return {"campaign_id": campaign_id, "summary": f"Campaign '{campaign.name}' is ready."}
 
 @app.route("/nylas/view-campaigns")
 def view_campaigns():
-    campaigns = Campaign.query.all()
-    return render_template("view-campaigns.html", campaigns=campaigns)
+    status = request.args.get("status")
+    query = Campaign.query.filter_by(status=status) if status else Campaign.query
+    campaigns, next_cursor = keyset_page(
+        query,
+        Campaign.id,
+        after=request.args.get("after", type=int),
+        limit=page_size(request.args.get("limit")),
+        descending=True,
+    )
+    return render_template("view-campaigns.html", campaigns=campaigns, next_cursor=next_cursor, status=status,
+                           delivery_counts=delivery_counts(c.id for c in campaigns))
+
+@app.route("/nylas/campaigns/<int:campaign_id>/deliveries.csv", methods=["GET"])
+def export_deliveries(campaign_id):
+    if db.session.get(Campaign, campaign_id) is None:
+        return jsonify({"error": "Campaign not found"}), 404
+    return csv_response(f"campaign-{campaign_id}-deliveries.csv", DELIVERY_HEADER, iter_delivery_rows(campaign_id),
+                        compress=request.args.get("gzip") == "1")
+
+@app.route("/api/campaigns", methods=["GET"])
+def list_campaigns():
+    status = request.args.get("status")
+    query = Campaign.query.filter_by(status=status) if status else Campaign.query
+    campaigns, next_cursor = keyset_page(
+        query,
+        Campaign.id,
+        after=request.args.get("after", type=int),
+        limit=page_size(request.args.get("limit")),
+        descending=True,
+    )
+    counts = delivery_counts(c.id for c in campaigns)
+    return jsonify({
+        "data": [dict(c.to_dict(), deliveries=counts.get(c.id, {})) for c in campaigns],
+        "next_cursor": next_cursor,
+    })
+
 
+# Scheduled jobs live in the app database. Every process can add jobs, but only
+# the holder of the scheduler lease fires them (see scheduling.py).
+with app.app_context():
+    scheduler = create_scheduler(misfire_grace_time=app.config["CAMPAIGN_MISFIRE_GRACE_SECONDS"])
+
+def campaign_job_id(campaign_id):
+    return f"campaign-{campaign_id}"
+
+def add_campaign_send(campaign_id, grant_id, run_date=None):
+    # A one-off send is never dropped for being late (misfire_grace_time=None):
+    # a campaign that was due while no process was up goes out on startup.
+    scheduler.add_job(
+        run_job, 'date', run_date=run_date, args=["send_campaign", campaign_id, grant_id],
+        id=campaign_job_id(campaign_id), replace_existing=True, misfire_grace_time=None,
+    )
+
+def requeue_missed_campaign(event):
+    # Send jobs stored before they stopped expiring can still be missed, which
+    # deletes them. Queue the campaign again instead of leaving it 'scheduled'.
+    if not event.job_id.startswith("campaign-") or scheduler.get_job(event.job_id) is not None:
+        return
+    with app.app_context():
+        campaign = db.session.get(Campaign, int(event.job_id.split("-", 1)[1]))
+        if campaign and campaign.status in ('scheduled', 'partial') and campaign.grant_id:
+            app.logger.warning(f"Campaign {campaign.id} missed its send time; sending now")
+            add_campaign_send(campaign.id, campaign.grant_id)
 
-scheduler = BackgroundScheduler()
-scheduler.start()
+scheduler.add_listener(requeue_missed_campaign, EVENT_JOB_MISSED)
 
-def send_campaign_emails(campaign_id):
+def resume_interrupted_campaigns():
+    # Date jobs leave the job store as soon as they start, so a campaign whose
+    # process died mid-send has no job left. Its ledger still has pending rows.
+    with app.app_context():
+        overdue = Campaign.query.filter(
+            Campaign.status == 'scheduled',
+            Campaign.grant_id.isnot(None),
+            Campaign.scheduled_at <= datetime.utcnow(),
+        )
+        max_attempts = app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"]
+        for campaign in overdue:
+            if scheduler.get_job(campaign_job_id(campaign.id)) is None and count_undelivered(campaign.id, max_attempts):
+                app.logger.info(f"Resuming interrupted campaign {campaign.id}")
+                add_campaign_send(campaign.id, campaign.grant_id)
+        # Partial campaigns whose remaining rows have all used up their
+        # attempts can't make progress; settle them instead of offering Resume
+        for campaign in Campaign.query.filter(Campaign.status == 'partial'):
+            if not count_undelivered(campaign.id, max_attempts):
+                campaign.status = finished_status(campaign, 'staged' if can_prestage(campaign) else 'sent')
+        # A campaign left 'staging' without a live stage_campaign job was
+        # interrupted mid-stage; 'partial' lets it be resumed from the ledger
+        staging = {
+            json.loads(params or "{}").get("campaign_id")
+            for params in db.session.execute(
+                db.select(Job.params).where(Job.kind == 'stage_campaign', Job.status.in_(('queued', 'running')))
+            ).scalars()
+        }
+        stuck = db.session.execute(
+            update(Campaign)
+            .where(Campaign.status == 'staging', Campaign.id.notin_(staging - {None}))
+            .values(status='partial')
+        ).rowcount
+        db.session.commit()
+        if stuck:
+            app.logger.warning(f"Marked {stuck} interrupted staging campaigns as partial")
+
+@job_target("sweep_sessions")
+def sweep_sessions():
+    with app.app_context():
+        deleted = app.session_interface.sweep()
+        if deleted:
+            app.logger.info(f"Removed {deleted} expired sessions")
+
+scheduler_supervisor = SchedulerSupervisor(
+    scheduler,
+    LeaderLease(app, ttl=app.config["SCHEDULER_LEASE_TTL"]),
+    on_leadership=resume_interrupted_campaigns,
+)
+
+def dispatch_campaign(campaign, grant_id, send_times=None, on_progress=None):
+    # Sends every undelivered message in the campaign's ledger. With
+    # send_times (an iterator of unix timestamps) each message is instead
+    # handed to Nylas with a send_at and recorded as 'staged'.
+    max_attempts = app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"]
+    renderer = CampaignRenderer.for_campaign(campaign)
+    recorder = DeliveryRecorder(accepted_status='sent' if send_times is None else 'staged', max_attempts=max_attempts)
+    done = 0
+
+    def messages():
+        pending = iter_pending(campaign.id, max_attempts)
+        for (delivery_id, attempts, _, name, email), suppressed in suppressions.partition(pending, lambda row: row[4]):
+            if suppressed:
+                recorder.record_suppressed(delivery_id, attempts)
+                continue
+            subject, body = renderer.render(name, email)
+            request_body = {
+                "subject": subject,
+                "body": body,
+                "to": [{"name": name, "email": email}]
+            }
+            if send_times is not None:
+                request_body["send_at"] = next(send_times)
+            yield (delivery_id, attempts, email), request_body
+
+    def record_result(result):
+        nonlocal done
+        delivery_id, attempts, email = result.key
+        if not result.ok:
+            app.logger.error(f"Error sending email to {email}: {str(result.error)}")
+        recorder.record(delivery_id, attempts, result)
+        done += 1
+        if on_progress:
+            on_progress(done)
+
+    stats = dispatcher.send_all(grant_id, messages(), on_result=record_result)
+    recorder.flush()
+    return stats
+
+def finished_status(campaign, done_status):
+    # Status after a run: done_status once every recipient is settled,
+    # 'partial' while some can still be retried, and 'done_with_failures' when
+    # the only ones left have used up their attempts (Resume would skip them).
+    if count_undelivered(campaign.id, app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"]):
+        return 'partial'
+    return 'done_with_failures' if count_undelivered(campaign.id) else done_status
+
+@job_target("send_campaign")
+def send_campaign_emails(campaign_id, grant_id):
     with app.app_context():
         campaign = Campaign.query.get(campaign_id)
         if campaign:
-            recipients = Recipient.query.all()
-            for recipient in recipients:
-                try:
-                    body = {
-                        "subject": campaign.subject,
-                        "body": campaign.body,
-                        "to": [{"name": recipient.name, "email": recipient.email}]
-                    }
-                    nylas.messages.send(session["grant_id"], request_body=body)
-                except Exception as e:
-                    print(f"Error sending email to {recipient.email}: {str(e)}")
-            if campaign.status == 'scheduled':
-                campaign.status = 'sent'
+            # Every firing of a recurring campaign is a new run with a fresh
+            # ledger, so recipients that failed for good last time don't block
+            # it. Other campaigns resume from whatever is still undelivered.
+            if campaign.status == 'recurring':
+                reset_deliveries(campaign_id)
+            seed_deliveries(campaign_id, db.session.get(Segment, campaign.segment_id) if campaign.segment_id else None)
+            stats = dispatch_campaign(campaign, grant_id)
+            app.logger.info(f"Campaign {campaign_id} dispatched: {stats.as_dict()}")
+            if campaign.status in ('scheduled', 'partial'):
+                campaign.status = finished_status(campaign, 'sent')
                 db.session.commit()
+            return stats.as_dict()
+
+def can_prestage(campaign):
+    # Nylas only accepts send_at up to a limit ahead; campaigns whose window
+    # ends later are left to our own scheduler.
+    if not campaign.delivery_window or campaign.status not in ('scheduled', 'partial'):
+        return False
+    window_end = (campaign.scheduled_at or datetime.utcnow()) + timedelta(seconds=campaign.delivery_window)
+    return window_end <= datetime.utcnow() + timedelta(days=app.config["NYLAS_SEND_AT_MAX_DAYS"])
+
+def stage_campaign_failed(campaign_id, **params):
+    db.session.execute(
+        update(Campaign).where(Campaign.id == campaign_id, Campaign.status == 'staging').values(status='partial')
+    )
+
+@jobs.task("stage_campaign", on_failure=stage_campaign_failed)
+def stage_campaign_job(job, campaign_id, grant_id):
+    # Submits the whole campaign to Nylas now, with send_at spread over the
+    # delivery window starting at scheduled_at. Nothing in this process has to
+    # be running when the messages actually go out.
+    claimed = db.session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status.in_(('scheduled', 'partial')))
+        .values(status='staging')
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return {"summary": "Campaign is already being staged."}
+    campaign = db.session.get(Campaign, campaign_id)
+    seed_deliveries(campaign_id, db.session.get(Segment, campaign.segment_id) if campaign.segment_id else None)
+    total = count_undelivered(campaign_id, app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"])
+    earliest = datetime.utcnow() + timedelta(seconds=app.config["CAMPAIGN_STAGE_MIN_LEAD"])
+    start = max(campaign.scheduled_at or earliest, earliest)
+    # A resumed campaign spreads what is left over what is left of the window
+    window = campaign.delivery_window
+    if campaign.scheduled_at:
+        window = max(0, int((campaign.scheduled_at + timedelta(seconds=window) - start).total_seconds()))
+    job.update(progress=0, total=total, message="Staging messages with Nylas", force=True)
+    stats = dispatch_campaign(campaign, grant_id, send_times=spread_send_times(start, window, total),
+                              on_progress=lambda done: job.update(progress=done))
+    campaign.status = finished_status(campaign, 'staged')
+    db.session.commit()
+    app.logger.info(f"Campaign {campaign_id} staged: {stats.as_dict()}")
+    return dict(stats.as_dict(), summary=f"Staged {stats.sent} messages for '{campaign.name}', {stats.failed} failed.")
 
 @app.route("/nylas/schedule-campaign/<int:campaign_id>", methods=["POST"])
 def schedule_campaign(campaign_id):
+    if 'grant_id' not in session:
+        flash("Please authenticate with Nylas first.", "warning")
+        return redirect(url_for('login'))
     campaign = Campaign.query.get(campaign_id)
     if campaign:
-        if campaign.status == 'scheduled':
-            scheduler.add_job(
-                send_campaign_emails, 
-                'date', 
-                run_date=campaign.scheduled_at, 
-                args=[campaign_id]
-            )
+        campaign.grant_id = session["grant_id"]
+        if campaign.status == 'partial' and not count_undelivered(campaign_id, app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"]):
+            campaign.status = finished_status(campaign, 'staged' if can_prestage(campaign) else 'sent')
+            db.session.commit()
+            flash("Nothing left to resume: every remaining recipient has used up its delivery attempts", "warning")
+            return redirect(url_for('view_campaigns'))
+        db.session.commit()
+        if can_prestage(campaign):
+            if scheduler.get_job(campaign_job_id(campaign_id)):
+                scheduler.remove_job(campaign_job_id(campaign_id))
+            job_id = jobs.enqueue("stage_campaign", campaign_id=campaign_id, grant_id=session["grant_id"])
+            flash("Staging campaign with Nylas...", "success")
+            return redirect(url_for('view_campaigns', job_id=job_id))
+        # One job per campaign: scheduling again replaces the existing job
+        if campaign.status in ('scheduled', 'partial'):
+            now = datetime.utcnow()
+            run_date = max(campaign.scheduled_at, now) if campaign.status == 'scheduled' and campaign.scheduled_at else now
+            add_campaign_send(campaign_id, session["grant_id"], run_date)
         elif campaign.status == 'recurring':
             scheduler.add_job(
-                send_campaign_emails,
+                run_job,
                 CronTrigger(day_of_week='mon'),  # This schedules it for every Monday
-                args=[campaign_id]
+                args=["send_campaign", campaign_id, session["grant_id"]],
+                id=campaign_job_id(campaign_id), replace_existing=True,
             )
+        else:
+            flash(f"A campaign that is '{campaign.status}' can't be scheduled", "error")
+            return redirect(url_for('view_campaigns'))
         flash("Campaign scheduled successfully", "success")
     else:
         flash("Invalid campaign", "error")
     return redirect(url_for('view_campaigns'))
 
+# Calls that create something in Nylas. A timeout or 5xx may come after Nylas
+# acted on them, so they are only retried when it can't have.
+NON_IDEMPOTENT_NYLAS_OPERATIONS = {"messages.send", "drafts.create"}
+
 # Function to handle retries for Nylas API calls
-def nylas_retry(func, *args, max_retries=3, backoff_factor=2, **kwargs):
-    for attempt in range(max_retries):
+def nylas_retry(func, *args, **kwargs):
+    # Retries transport errors, 429s and 5xx (see resilience.py) within a short
+    # deadline on request threads and a longer one in jobs. Each endpoint has
+    # its own circuit breaker, so an outage fails fast instead of stalling.
+    operation = metrics.nylas_operation(func)
+    non_idempotent = operation in NON_IDEMPOTENT_NYLAS_OPERATIONS
+
+    def attempt(timeout):
+        overrides = resilience.nylas_overrides(timeout, kwargs.get("overrides"))
+        with metrics.nylas_call(operation):
+            return func(*args, **dict(kwargs, overrides=overrides))
+
+    return resilience.call(
+        attempt,
+        breaker=resilience.get_breaker(f"nylas:{operation}"),
+        on_retry=lambda error, delay: metrics.NYLAS_RETRIES.inc(operation=operation),
+        retryable=resilience.is_safe_to_resend if non_idempotent else resilience.is_retryable,
+    )
+
+message_store = MessageStore(nylas, app, request=nylas_retry)
+
+DEFAULT_REFINEMENT_INSTRUCTIONS = "Make the response more concise and professional."
+
+def prompt_body(message, call_site, model="gpt-4o-mini"):
+    # The message body as it goes into a prompt: cleaned (and cached) by the
+    # message store, then cut to the call site's token budget
+    return truncate_tokens(message_store.body_text(message), app.config["PROMPT_TOKEN_BUDGETS"][call_site], model)
+
+# Streams LLM tokens to the browser as Server-Sent Events. make_tokens is called
+# inside the stream so lookups that can fail are reported as an error event.
+def sse_response(make_tokens):
+    @stream_with_context
+    def events():
+        text = []
         try:
-            return func(*args, **kwargs)
+            for token in make_tokens():
+                text.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            yield f"event: done\ndata: {json.dumps({'text': ''.join(text).strip()})}\n\n"
         except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(backoff_factor ** attempt)  # Exponential backoff
-            else:
-                raise e
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/")
 def index():
@@ -254,9 +778,8 @@ def authorized():
 
 @app.route("/nylas/recent-emails", methods=["GET"])
 def recent_emails():
-    query_params = {"limit": 50}
     try:
-        messages, _, _ = nylas_retry(nylas.messages.list, session["grant_id"], query_params)
+        messages = message_store.recent(session["grant_id"], limit=50)
         return render_template("recent-emails.html", messages=messages)
     except Exception as e:
         return render_template("recent-emails.html", error=str(e))
@@ -265,37 +788,55 @@ def recent_emails():
 @app.route("/nylas/email/<message_id>", methods=["GET", "POST"])
 def view_email(message_id):
     try:
-        # Unpack the tuple returned by find
-        message, request_id = nylas_retry(nylas.messages.find, session["grant_id"], message_id)
-        
-        # Print message structure for debugging
-        print("Message structure:", message)
+        message = message_store.get(session["grant_id"], message_id)
         
         if request.method == "POST":
-            generated_response = generate_response(message.body)
+            generated_response = generate_response(prompt_body(message, "generate_response"))
             return render_template("view-email.html", message=message, generated_response=generated_response)
         
         return render_template("view-email.html", message=message)
     except Exception as e:
-        print("Error in view_email:", str(e))  # Print the error for debugging
+        app.logger.error(f"Error in view_email: {e}")
         return render_template("view-email.html", error=str(e))
     
+@app.route("/nylas/email/<message_id>/stream", methods=["POST"])
+def stream_response(message_id):
+    def tokens():
+        message = message_store.get(session["grant_id"], message_id)
+        return llm.stream("generate_response", **response_request(prompt_body(message, "generate_response")))
+    return sse_response(tokens)
+
 @app.route("/nylas/email/<message_id>/refine", methods=["POST"])
 def refine_response(message_id):
     try:
-        message, _ = nylas_retry(nylas.messages.find, session["grant_id"], message_id)
+        message = message_store.get(session["grant_id"], message_id)
         current_response = request.form.get("response")
-        refinement_instructions = "Make the response more concise and professional."
-        refined_response = generate_refined_response(message.body, current_response, refinement_instructions)
+        refined_response = generate_refined_response(
+            prompt_body(message, "generate_refined_response", "gpt-3.5-turbo"), current_response, DEFAULT_REFINEMENT_INSTRUCTIONS
+        )
         return render_template("view-email.html", message=message, generated_response=refined_response, refined=True)
     except Exception as e:
         return render_template("view-email.html", error=str(e))
     
     
+@app.route("/nylas/email/<message_id>/refine/stream", methods=["POST"])
+def stream_refined_response(message_id):
+    current_response = request.form.get("response")
+    def tokens():
+        message = message_store.get(session["grant_id"], message_id)
+        return llm.stream(
+            "generate_refined_response",
+            **refined_response_request(
+                prompt_body(message, "generate_refined_response", "gpt-3.5-turbo"), current_response,
+                DEFAULT_REFINEMENT_INSTRUCTIONS,
+            )
+        )
+    return sse_response(tokens)
+
 @app.route("/nylas/email/<message_id>/send", methods=["POST"])
 def send_response(message_id):
     try:
-        original_message, _ = nylas_retry(nylas.messages.find, session["grant_id"], message_id)
+        original_message = message_store.get(session["grant_id"], message_id)
         response_body = request.form.get("response")
         
         # Get the first 'from' email address if available
@@ -312,11 +853,15 @@ def send_response(message_id):
         }
         
         nylas_retry(nylas.messages.send, session["grant_id"], request_body=body)
+        message_store.invalidate(session["grant_id"])
         
         flash("Response sent successfully!", "success")
         return redirect(url_for('recent_emails'))
     except Exception as e:
-        flash(f"Error sending response: {str(e)}", "error")
+        if resilience.outcome_unknown(e):
+            flash(f"The response may have been sent; check your Sent folder before retrying ({e}).", "warning")
+        else:
+            flash(f"Error sending response: {str(e)}", "error")
         return redirect(url_for('view_email', message_id=message_id))
     
 
@@ -348,9 +893,13 @@ def send_email():
                     email_data["send_at"] = int(schedule_date.timestamp())
                 
                 message = nylas_retry(nylas.messages.send, session["grant_id"], request_body=email_data)
+                message_store.invalidate(session["grant_id"])
                 flash("Email scheduled successfully" if action == "schedule" else "Email sent successfully", "success")
             except Exception as e:
-                flash(f"Error sending email: {str(e)}", "error")
+                if resilience.outcome_unknown(e):
+                    flash(f"The email may have been sent; check your Sent folder before retrying ({e}).", "warning")
+                else:
+                    flash(f"Error sending email: {str(e)}", "error")
 
         return redirect(url_for("send_email"))
 
@@ -365,42 +914,72 @@ def generate_email():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@app.route("/nylas/generate-email/stream", methods=["POST"])
+def generate_email_stream():
+    prompt = request.form.get("prompt")
+    return sse_response(lambda: llm.stream("generate_email_content", **email_content_request(prompt)))
+
+def email_content_request(prompt):
+    return dict(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You are an AI assistant that helps draft professional emails."},
+            {"role": "user", "content": f"Draft an email based on this prompt: {prompt}"}
+        ],
+        max_tokens=300,
+        temperature=0.7
+    )
+
 def generate_email_content(prompt):
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an AI assistant that helps draft professional emails."},
-                {"role": "user", "content": f"Draft an email based on this prompt: {prompt}"}
-            ],
-            max_tokens=300,
-            temperature=0.7
-        )
-        return response.choices[0].message.content.strip()
+        return llm.complete("generate_email_content", **email_content_request(prompt))
     except Exception as e:
         raise Exception(f"Error generating email content: {str(e)}")
 
 @app.route("/nylas/categorize-emails", methods=["GET"])
 def categorize_emails():
+    job_id = request.args.get("job_id")
     try:
-        messages, _, _ = nylas_retry(nylas.messages.list, session["grant_id"], {"limit": 100})
-        categorized_emails = {}
-        for message in messages:
-            category = categorize_email(message.subject, message.snippet)
-            if category not in categorized_emails:
-                categorized_emails[category] = []
-            categorized_emails[category].append({
-                "id": message.id,
-                "subject": message.subject,
-                "snippet": message.snippet
-            })
-        
-        # Sort categories by number of emails (descending)
-        sorted_categories = sorted(categorized_emails.items(), key=lambda x: len(x[1]), reverse=True)
-        
-        return render_template("categorize-email.html", categorized_emails=sorted_categories)
+        if not job_id:
+            job_id = jobs.enqueue("categorize_emails", grant_id=session["grant_id"])
+            return redirect(url_for('categorize_emails', job_id=job_id))
+        job = jobs.get(job_id)
+        if job is None:
+            return render_template("categorize-email.html", error="Categorization job not found.")
+        if job.status == 'failed':
+            return render_template("categorize-email.html", error=job.error)
+        if job.status == 'succeeded':
+            return render_template("categorize-email.html", categorized_emails=json.loads(job.result))
+        # Still running: base.html shows the job's progress and reloads when done
+        return render_template("categorize-email.html", categorized_emails=[])
     except Exception as e:
         return render_template("categorize-email.html", error=str(e))
+
+@jobs.task("categorize_emails")
+def categorize_emails_job(job, grant_id):
+    messages = list(iter_messages(nylas, grant_id, limit=app.config["CATEGORIZE_MESSAGE_LIMIT"], request=nylas_retry))
+    categories = categorize_messages(
+        llm,
+        grant_id,
+        messages,
+        batch_size=app.config["CATEGORIZE_BATCH_SIZE"],
+        workers=app.config["CATEGORIZE_WORKERS"],
+        token_budget=app.config["PROMPT_TOKEN_BUDGETS"]["categorize_batch"],
+        progress=lambda done, total: job.update(progress=done, total=total),
+    )
+    categorized_emails = {}
+    for message in messages:
+        category = categories[message.id]
+        if category not in categorized_emails:
+            categorized_emails[category] = []
+        categorized_emails[category].append({
+            "id": message.id,
+            "subject": message.subject,
+            "snippet": message.snippet
+        })
+    
+    # Sort categories by number of emails (descending)
+    return sorted(categorized_emails.items(), key=lambda x: len(x[1]), reverse=True)
     
 
 
@@ -410,93 +989,122 @@ def send_bulk_email():
         prompt = request.form.get("prompt")
         subject = request.form.get("subject")
         try:
-            email_content = generate_marketing_email(prompt)
-            # You would have your own logic to fetch the recipients for bulk email
-            recipients = [{"name": "Recipient Name", "email": "recipient@example.com"}]  # Replace with real data
-            errors = []
-            for recipient in recipients:
-                try:
-                    body = {
-                        "subject": subject,
-                        "body": email_content,
-                        "to": [recipient]
-                    }
-                    nylas_retry(nylas.messages.send, session["grant_id"], request_body=body).data
-                except Exception as e:
-                    errors.append(str(e))
-            if errors:
-                return render_template("send_bulk_email.html", status="error", errors=errors)
-            return render_template("send_bulk_email.html", status="success", message="Bulk emails sent successfully")
+            job_id = jobs.enqueue("send_bulk_email", prompt=prompt, subject=subject, grant_id=session["grant_id"])
+            return redirect(url_for('send_bulk_email', job_id=job_id))
         except Exception as e:
-            return render_template("send_bulk_email.html", status="error", errors=[str(e)])
-    return render_template("send_bulk_email.html")
+            return render_template("bulk-email.html", status="error", errors=[str(e)])
+    job_id = request.args.get("job_id")
+    job = jobs.get(job_id) if job_id else None
+    if job and job.status == 'failed':
+        return render_template("bulk-email.html", status="error", errors=[job.error])
+    if job and job.status == 'succeeded':
+        errors = json.loads(job.result)["errors"]
+        if errors:
+            return render_template("bulk-email.html", status="error", errors=errors)
+        return render_template("bulk-email.html", status="success", message="Bulk emails sent successfully")
+    return render_template("bulk-email.html")
 
-# Helper functions (make sure these are defined)
-def categorize_email(email_subject, email_body):
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an email categorization assistant. Categorize emails into specific, concise categories that can be used for grouping. Use categories like 'Work', 'Personal', 'Finance', 'Travel', 'Shopping', 'Social', 'News', 'Marketing', 'Education', etc. If none of these fit, create a suitable category name. Provide only the category name, nothing else."},
-                {"role": "user", "content": f"Categorize this email based on the subject and body. Subject: {email_subject}. Body: {email_body}"}
-            ],
-            temperature=0.3
-        )
-        category = response.choices[0].message.content.strip()
-        return category
-    except Exception as e:
-        return f"Error categorizing email: {str(e)}"
+@jobs.task("send_bulk_email")
+def send_bulk_email_job(job, prompt, subject, grant_id):
+    job.update(message="Generating email content", force=True)
+    email_content = generate_marketing_email(prompt)
+    renderer = CampaignRenderer(subject, email_content)
+    total = Recipient.query.count()
+    errors = []
+    done = 0
+    skipped = 0
+
+    def messages():
+        nonlocal done, skipped
+        for (name, email), suppressed in suppressions.partition(iter_recipients(), lambda row: row[1]):
+            if suppressed:
+                done += 1
+                skipped += 1
+                continue
+            rendered_subject, body = renderer.render(name, email)
+            yield email, {
+                "subject": rendered_subject,
+                "body": body,
+                "to": [{"name": name, "email": email}]
+            }
+
+    def record_result(result):
+        nonlocal done
+        done += 1
+        if not result.ok:
+            errors.append(f"{result.key}: {result.error}")
+        job.update(progress=done, total=total, message="Sending")
+
+    stats = dispatcher.send_all(grant_id, messages(), on_result=record_result)
+    return {"sent": stats.sent, "suppressed": skipped, "errors": errors[:100], "stats": stats.as_dict()}
+
+def response_request(email_body, tone="professional"):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": f"You are an assistant that generates {tone} email responses."},
+            {"role": "user", "content": f"Write a {tone} response to this email: {email_body}"}
+        ],
+        max_tokens=150,
+        temperature=0.7
+    )
 
 def generate_response(email_body, tone="professional"):
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You are an assistant that generates {tone} email responses."},
-                {"role": "user", "content": f"Write a {tone} response to this email: {email_body}"}
-            ],
-            max_tokens=150,
-            temperature=0.7
-        )
-        suggested_response = response.choices[0].message.content.strip()
+        suggested_response = llm.complete("generate_response", **response_request(email_body, tone))
         return suggested_response
     except Exception as e:
         return f"Error generating response: {str(e)}"
 
+def refined_response_request(original_email, current_response, refinement_instructions):
+    return dict(
+        model="gpt-3.5-turbo",  # or "gpt-4" if available
+        messages=[
+            {"role": "system", "content": "You are an assistant that refines email responses based on user instructions."},
+            {"role": "user", "content": f"Original email: {original_email}"},
+            {"role": "assistant", "content": f"Current response: {current_response}"},
+            {"role": "user", "content": f"Please refine the response according to these instructions: {refinement_instructions}"}
+        ],
+        max_tokens=200,
+        temperature=0.7
+    )
+
 def generate_refined_response(original_email, current_response, refinement_instructions):
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # or "gpt-4" if available
-            messages=[
-                {"role": "system", "content": "You are an assistant that refines email responses based on user instructions."},
-                {"role": "user", "content": f"Original email: {original_email}"},
-                {"role": "assistant", "content": f"Current response: {current_response}"},
-                {"role": "user", "content": f"Please refine the response according to these instructions: {refinement_instructions}"}
-            ],
-            max_tokens=200,
-            temperature=0.7
+        refined_response = llm.complete(
+            "generate_refined_response",
+            **refined_response_request(original_email, current_response, refinement_instructions)
         )
-        refined_response = response.choices[0].message.content.strip()
         return refined_response
     except Exception as e:
         return f"Error refining response: {str(e)}"
 
 def generate_marketing_email(advertisement_prompt):
     try:
-        response = client.chat.completions.create(
+        email_content = llm.complete(
+            "generate_marketing_email",
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": "You are a marketing email generator. Create compelling and engaging marketing emails based on the given prompt."},
+                {"role": "system", "content": "You are a marketing email generator. Create compelling and engaging marketing emails based on the given prompt. " + MERGE_FIELD_INSTRUCTIONS},
                 {"role": "user", "content": f"Create a marketing email based on the following input: {advertisement_prompt}"}
             ],
             max_tokens=300,
             temperature=0.8
         )
-        email_content = response.choices[0].message.content.strip()
         return email_content
     except Exception as e:
         return f"Error generating marketing email: {str(e)}"
+
+with app.app_context():
+    db.create_all()
+    upgrade_schema()
+    suppressions.load()
+    scheduler.add_job(
+        run_job, 'interval', args=["sweep_sessions"], seconds=app.config["SESSION_SWEEP_INTERVAL"],
+        id="sweep-sessions", replace_existing=True,
+    )
+jobs.start()
+scheduler_supervisor.start()
+
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
     app.run(debug=True)
\ No newline at end of file
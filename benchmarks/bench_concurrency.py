@@ -0,0 +1,150 @@
+# Stress test for concurrent SQLite access: writer threads apply batched
+# delivery-ledger updates (as DeliveryRecorder does during a campaign send)
+# while reader threads page through recipients (as the listing pages do).
+# Runs once with SQLAlchemy's defaults and once with the engine settings
+# from database.py (WAL, busy_timeout, synchronous=NORMAL, sized pool).
+#
+#   python benchmarks/bench_concurrency.py --seconds 10 --writers 4 --readers 8
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from flask import Flask
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.exc import OperationalError
+
+from database import engine_options, init_database
+from models import db, Recipient, Campaign, CampaignDelivery
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(1000 * samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 2)
+
+
+def make_app(tmp, tuned, pool_size, recipients):
+    app = Flask(__name__)
+    uri = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    if tuned:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(uri, pool_size=pool_size)
+    db.init_app(app)
+    if tuned:
+        init_database(app, db)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Recipient.__table__.insert(), [
+            {"name": f"Person {i}", "email": f"person{i}@example.com"} for i in range(recipients)
+        ])
+        campaign = Campaign(name="bench", subject="s", body="b", status="scheduled")
+        db.session.add(campaign)
+        db.session.flush()
+        db.session.execute(CampaignDelivery.__table__.insert(), [
+            {"campaign_id": campaign.id, "recipient_id": i + 1, "status": "pending", "attempts": 0}
+            for i in range(recipients)
+        ])
+        db.session.commit()
+    return app
+
+
+def writer(app, stop, recipients, batch_size, stats):
+    table = CampaignDelivery.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(status=bindparam("b_status"), attempts=table.c.attempts + 1)
+    )
+    with app.app_context():
+        while not stop.is_set():
+            start = random.randint(1, recipients - batch_size)
+            rows = [{"b_id": i, "b_status": random.choice(("sent", "failed"))} for i in range(start, start + batch_size)]
+            started = time.perf_counter()
+            try:
+                db.session.execute(statement, rows)
+                db.session.commit()
+                stats["write_latencies"].append(time.perf_counter() - started)
+            except OperationalError:
+                db.session.rollback()
+                stats["write_errors"] += 1
+            time.sleep(0.005)
+
+
+def reader(app, stop, recipients, stats):
+    with app.app_context():
+        while not stop.is_set():
+            after = random.randint(0, recipients - 50)
+            started = time.perf_counter()
+            try:
+                db.session.execute(
+                    select(Recipient.id, Recipient.name, Recipient.email)
+                    .where(Recipient.id > after).order_by(Recipient.id).limit(50)
+                ).all()
+                db.session.execute(
+                    select(CampaignDelivery.status, db.func.count())
+                    .where(CampaignDelivery.campaign_id == 1).group_by(CampaignDelivery.status)
+                ).all()
+                db.session.commit()
+                stats["read_latencies"].append(time.perf_counter() - started)
+            except OperationalError:
+                db.session.rollback()
+                stats["read_errors"] += 1
+
+
+def run(label, tuned, args):
+    stats = {"read_latencies": [], "write_latencies": [], "read_errors": 0, "write_errors": 0}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(tmp, tuned, args.writers + args.readers, args.recipients)
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=writer, args=(app, stop, args.recipients, args.batch_size, stats))
+            for _ in range(args.writers)
+        ] + [
+            threading.Thread(target=reader, args=(app, stop, args.recipients, stats))
+            for _ in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        with app.app_context():
+            db.engine.dispose()
+    return {
+        "config": label,
+        "reads_per_second": round(len(stats["read_latencies"]) / args.seconds, 1),
+        "read_p50_ms": percentile(stats["read_latencies"], 50),
+        "read_p99_ms": percentile(stats["read_latencies"], 99),
+        "read_errors": stats["read_errors"],
+        "write_batches_per_second": round(len(stats["write_latencies"]) / args.seconds, 1),
+        "write_p50_ms": percentile(stats["write_latencies"], 50),
+        "write_p99_ms": percentile(stats["write_latencies"], 99),
+        "write_errors": stats["write_errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--recipients", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    random.seed(0)
+    print(json.dumps({
+        "results": [run("default", False, args), run("wal_tuned", True, args)],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
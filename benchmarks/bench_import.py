@@ -0,0 +1,83 @@
+# Compares the bulk upsert import path against the old one-SELECT-per-row
+# import on a throwaway SQLite database.
+#
+#   python benchmarks/bench_import.py --rows 200000
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from flask import Flask
+
+from importer import bulk_upsert_recipients, iter_csv_rows
+from models import db, Recipient
+
+
+def make_csv(rows, duplicate_every=10):
+    buffer = io.StringIO()
+    buffer.write("name,email\n")
+    for i in range(rows):
+        # Every Nth row repeats an earlier address so both paths see updates
+        n = i // 2 if duplicate_every and i % duplicate_every == 0 else i
+        buffer.write(f"Person {i},person{n}@example.com\n")
+    buffer.seek(0)
+    return buffer
+
+
+def per_row_import(text_stream):
+    # The import loop as it was before the bulk path, kept for comparison
+    for name, email in iter_csv_rows(text_stream):
+        name, email = (name or "").strip(), (email or "").strip()
+        if name and email:
+            existing_recipient = Recipient.query.filter_by(email=email).first()
+            if existing_recipient:
+                existing_recipient.name = name
+            else:
+                db.session.add(Recipient(name=name, email=email))
+    db.session.commit()
+
+
+def run(label, rows, fn):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            stream = make_csv(rows)
+            started = time.perf_counter()
+            fn(stream)
+            elapsed = time.perf_counter() - started
+            stored = Recipient.query.count()
+            db.session.remove()
+            db.engine.dispose()
+    return {
+        "path": label,
+        "rows": rows,
+        "stored": stored,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+    results = [
+        run("per_row", args.rows, per_row_import),
+        run("bulk_upsert", args.rows, lambda stream: bulk_upsert_recipients(iter_csv_rows(stream))),
+    ]
+    print(json.dumps({
+        "results": results,
+        "speedup": round(results[0]["seconds"] / results[1]["seconds"], 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
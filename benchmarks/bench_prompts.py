@@ -0,0 +1,180 @@
+# Measures what prompt preprocessing (email_text.py) saves on a generated
+# corpus of realistic email bodies: HTML replies with nested quoted threads,
+# Outlook-style replies, plain-text replies with ">" quotes and signatures,
+# and style-heavy newsletters. Reports prompt tokens before and after, the
+# cost of cleaning (cold and cached), and chat completion latency against the
+# fake OpenAI server with prompt processing time proportional to prompt size.
+#
+#   python benchmarks/bench_prompts.py --emails 200 --prompt-tokens-per-second 5000
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+sys.path.insert(0, BENCH_DIR)
+
+from openai import OpenAI
+
+from bench_suite import current_commit, percentile
+from email_text import clean_body, count_tokens, has_tokenizer, truncate_tokens
+from fakes import FakeOpenAI
+
+WORDS = ("meeting invoice schedule project update quarter review contract delivery budget team "
+         "client launch proposal deadline feedback design report customer support request").split()
+NAMES = ("Alex Morgan", "Sam Lee", "Jordan Patel", "Casey Kim", "Riley Chen", "Taylor Brooks")
+DISCLAIMER = ("CONFIDENTIALITY NOTICE: This email and any attachments are for the sole use of the intended "
+              "recipient(s) and may contain confidential and privileged information. Any unauthorized review, "
+              "use, disclosure or distribution is prohibited. ") * 2
+
+
+def sentence(rng, words=14):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng, sentences=4):
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def signature_html(name):
+    return (f'<div class="gmail_signature"><table><tr><td><b>{name}</b></td><td>Director</td></tr>'
+            f'<tr><td>+1 555 0100</td><td><a href="https://example.com">example.com</a></td></tr></table>'
+            f'<p style="font-size:8px;color:#999">{DISCLAIMER}</p></div>')
+
+
+def gmail_thread(rng, depth):
+    # Each reply quotes the whole thread so far in a nested blockquote
+    html = f"<div dir=\"ltr\">{paragraph(rng)}</div>{signature_html(rng.choice(NAMES))}"
+    for _ in range(depth):
+        sender = rng.choice(NAMES)
+        html = (f"<div dir=\"ltr\">{'<br><br>'.join(paragraph(rng) for _ in range(rng.randint(1, 3)))}</div>"
+                f"{signature_html(sender)}<div class=\"gmail_quote\"><div dir=\"ltr\" class=\"gmail_attr\">"
+                f"On Mon, Mar 4, 2024 at 10:{rng.randint(10, 59)} AM {sender} &lt;{sender.split()[0].lower()}"
+                f"@example.com&gt; wrote:<br></div><blockquote class=\"gmail_quote\" style=\"margin:0 0 0 .8ex;"
+                f"border-left:1px #ccc solid;padding-left:1ex\">{html}</blockquote></div>")
+    return f"<html><head><style>body{{font-family:Arial}} p{{margin:0}}</style></head><body>{html}</body></html>"
+
+
+def outlook_reply(rng, depth):
+    text = ""
+    for _ in range(depth):
+        sender = rng.choice(NAMES)
+        text = (f"<p>{paragraph(rng)}</p><p>Kind regards,<br>{sender}</p><hr>"
+                f"<div id=\"divRplyFwdMsg\"><b>From:</b> {sender}<br><b>Sent:</b> Monday, March 4, 2024<br>"
+                f"<b>To:</b> Team<br><b>Subject:</b> RE: {rng.choice(WORDS)}</div>{text}")
+    return f"<html><body><div>{paragraph(rng)}</div>{text}</body></html>"
+
+
+def plain_reply(rng, depth):
+    lines = [paragraph(rng), "", "--", rng.choice(NAMES), DISCLAIMER]
+    quoted = []
+    for level in range(1, depth + 1):
+        quoted += [f"On Tue, Mar 5, 2024 at 9:00 AM {rng.choice(NAMES)} wrote:"]
+        quoted += [">" * level + " " + sentence(rng) for _ in range(6)]
+    return "\n".join(lines[:1] + [""] + lines[2:] + [""] + quoted)
+
+
+def newsletter(rng):
+    rows = "".join(f"<tr><td style=\"padding:12px\"><h2>{sentence(rng, 6)}</h2><p>{paragraph(rng, 2)}</p>"
+                   f"<a href=\"https://example.com/{i}?utm_source=x\">Read more</a></td></tr>" for i in range(8))
+    styles = "".join(f".c{i}{{color:#{i:06x};padding:{i}px}}" for i in range(200))
+    return (f"<html><head><style>{styles}</style><script>track()</script></head><body>"
+            f"<table width=\"600\">{rows}</table><div style=\"font-size:9px\">{DISCLAIMER}</div></body></html>")
+
+
+def make_corpus(count, seed=0):
+    rng = random.Random(seed)
+    makers = [
+        lambda: gmail_thread(rng, rng.randint(0, 6)),
+        lambda: outlook_reply(rng, rng.randint(1, 5)),
+        lambda: plain_reply(rng, rng.randint(0, 4)),
+        lambda: newsletter(rng),
+    ]
+    return [makers[i % len(makers)]() for i in range(count)]
+
+
+def summarize(values):
+    return {
+        "total": sum(values),
+        "mean": round(statistics.mean(values), 1),
+        "p50": sorted(values)[len(values) // 2],
+        "max": max(values),
+    }
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def response_messages(email_body):
+    # Same shape as response_request() in app.py
+    return [
+        {"role": "system", "content": "You are an assistant that generates professional email responses."},
+        {"role": "user", "content": f"Write a professional response to this email: {email_body}"},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=1500, help="prompt token budget for the email body")
+    parser.add_argument("--prompt-tokens-per-second", type=int, default=5000,
+                        help="simulated prompt processing speed of the fake OpenAI server")
+    parser.add_argument("--llm-calls", type=int, default=50, help="completions per variant (raw, cleaned)")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.emails)
+    cleaned, clean_seconds = zip(*(timed(clean_body, body) for body in corpus))
+    # Cached path: the cleaned text is read back, only the budget is applied
+    prepared, truncate_seconds = zip(*(timed(truncate_tokens, text, args.budget) for text in cleaned))
+    raw_tokens = [count_tokens(body) for body in corpus]
+    prepared_tokens = [count_tokens(text) for text in prepared]
+
+    server = FakeOpenAI(prompt_tokens_per_second=args.prompt_tokens_per_second).start()
+    client = OpenAI(base_url=f"{server.url}/v1", api_key="bench", max_retries=0)
+    latencies = {"raw": [], "prepared": []}
+    for index in range(min(args.llm_calls, len(corpus))):
+        for variant, body in (("raw", corpus[index]), ("prepared", prepared[index])):
+            _, elapsed = timed(lambda: client.chat.completions.create(
+                model="gpt-4o-mini", messages=response_messages(body), max_tokens=150,
+            ))
+            latencies[variant].append(elapsed)
+    server.stop()
+
+    report = {
+        "commit": current_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "tokenizer": "tiktoken" if has_tokenizer() else "estimate",
+        "prompt_tokens": {
+            "raw": summarize(raw_tokens),
+            "prepared": summarize(prepared_tokens),
+            "reduction_percent": round(100 * (1 - sum(prepared_tokens) / sum(raw_tokens)), 1),
+            "raw_over_budget": sum(tokens > args.budget for tokens in raw_tokens),
+        },
+        "preprocessing_ms": {
+            "clean_p50": percentile(clean_seconds, 50),
+            "clean_p99": percentile(clean_seconds, 99),
+            "cached_p50": percentile(truncate_seconds, 50),
+            "cached_p99": percentile(truncate_seconds, 99),
+        },
+        "completion_latency_ms": {
+            variant: {"p50": percentile(samples, 50), "p99": percentile(samples, 99)}
+            for variant, samples in latencies.items()
+        },
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Compares the database session backend against Flask-Session's filesystem
+# store: requests that only read the session, requests that write it, and
+# the storage left behind once sessions expire.
+#
+#   python benchmarks/bench_sessions.py --sessions 2000 --requests 5000
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from flask import Flask, session
+from flask_session.filesystem import FileSystemSessionInterface
+
+from models import db, SessionRecord
+from sessions import DatabaseSessionInterface
+
+
+def make_app(tmp, backend):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=1)
+    db.init_app(app)
+    if backend == "filesystem":
+        app.session_interface = FileSystemSessionInterface(app, cache_dir=os.path.join(tmp, "flask_session"))
+    else:
+        app.session_interface = DatabaseSessionInterface(app)
+
+    @app.route("/login/<grant_id>")
+    def login(grant_id):
+        session["grant_id"] = grant_id
+        return "ok"
+
+    @app.route("/read")
+    def read():
+        return session.get("grant_id") or ""
+
+    @app.route("/touch")
+    def touch():
+        # Re-assigns the same value, as the auth callback does on every login
+        session["grant_id"] = session.get("grant_id")
+        return "ok"
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def timed_requests(client, cookies, path, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        client.set_cookie("session", random.choice(cookies))
+        client.get(path)
+    return time.perf_counter() - started
+
+
+def run(backend, sessions, requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(tmp, backend)
+        client = app.test_client()
+        cookies = []
+        started = time.perf_counter()
+        for i in range(sessions):
+            client.delete_cookie("session")
+            client.get(f"/login/grant-{i}")
+            cookies.append(client.get_cookie("session").value)
+        create_seconds = time.perf_counter() - started
+        read_seconds = timed_requests(client, cookies, "/read", requests)
+        touch_seconds = timed_requests(client, cookies, "/touch", requests)
+
+        if backend == "filesystem":
+            stored = len(os.listdir(os.path.join(tmp, "flask_session")))
+            stored_bytes = directory_size(os.path.join(tmp, "flask_session"))
+            swept = 0  # nothing removes expired files
+        else:
+            with app.app_context():
+                stored = SessionRecord.query.count()
+                stored_bytes = sum(len(data) for (data,) in db.session.query(SessionRecord.data))
+                db.session.query(SessionRecord).update({"expires_at": SessionRecord.expires_at - timedelta(hours=2)})
+                db.session.commit()
+                swept = app.session_interface.sweep()
+                db.session.remove()
+                db.engine.dispose()
+    return {
+        "backend": backend,
+        "sessions": sessions,
+        "create_per_second": round(sessions / create_seconds, 1),
+        "read_per_second": round(requests / read_seconds, 1),
+        "unchanged_write_per_second": round(requests / touch_seconds, 1),
+        "stored_entries": stored,
+        "stored_bytes": stored_bytes,
+        "expired_entries_swept": swept,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    random.seed(0)
+    print(json.dumps({
+        "results": [run(backend, args.sessions, args.requests) for backend in ("filesystem", "database")],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
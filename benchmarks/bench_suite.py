@@ -0,0 +1,227 @@
+# End-to-end benchmarks against local fake Nylas and OpenAI servers
+# (benchmarks/fakes.py), on a throwaway database. Runs the CSV import,
+# campaign send, categorization and inbox scenarios through the real app and
+# prints throughput and p50/p99 latency per scenario as JSON, tagged with the
+# current commit so runs can be compared.
+#
+#   python benchmarks/bench_suite.py --latency 0.05 --error-rate 0.02 --rate-limit-rate 0.02
+#   python benchmarks/bench_suite.py --scenarios inbox,categorize --output bench.json
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import Faults, FakeNylas, FakeOpenAI
+
+GRANT_ID = "bench-grant"
+SCENARIOS = ("import", "campaign", "categorize", "inbox")
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(1000 * samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 2)
+
+
+def summarize(latencies, items=None, **extra):
+    elapsed = sum(latencies)
+    count = items if items is not None else len(latencies)
+    return {
+        "runs": len(latencies),
+        "items": count,
+        "throughput_per_second": round(count / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        **extra,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_for_job(client, job_id, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").get_json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.02)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
+
+
+def job_id_from(response):
+    return response.headers["Location"].split("job_id=", 1)[1]
+
+
+def bench_import(app_module, client, args):
+    latencies = []
+    for run in range(args.runs):
+        csv = io.StringIO()
+        csv.write("name,email\n")
+        for i in range(args.rows):
+            csv.write(f"Person {i},person{run}-{i}@example.com\n")
+        data = {"file": (io.BytesIO(csv.getvalue().encode()), "recipients.csv")}
+        started = time.perf_counter()
+        response = client.post("/nylas/import-csv", data=data, content_type="multipart/form-data")
+        job = wait_for_job(client, job_id_from(response))
+        latencies.append(time.perf_counter() - started)
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"Import failed: {job['error']}")
+    return summarize(latencies, items=args.rows * args.runs, rows_per_run=args.rows)
+
+
+def bench_campaign(app_module, client, args):
+    from models import db, Recipient, Campaign, Segment
+    from segments import create_segment, add_members, audience_size
+
+    # Campaigns target a list segment so the audience doesn't depend on which
+    # other scenarios ran first
+    with app_module.app.app_context():
+        db.session.execute(
+            Recipient.__table__.insert().prefix_with("OR IGNORE"),
+            [{"name": f"Recipient {i}", "email": f"recipient{i}@example.com"} for i in range(args.recipients)],
+        )
+        db.session.commit()
+        segment = Segment.query.filter_by(name="bench-audience").first() or create_segment("bench-audience")
+        add_members(segment.id, (f"recipient{i}@example.com" for i in range(args.recipients)))
+        segment_id = segment.id
+        audience = audience_size(segment)
+    latencies = []
+    totals = {"sent": 0, "failed": 0, "retries": 0}
+    for run in range(args.runs):
+        with app_module.app.app_context():
+            campaign = Campaign(
+                name=f"bench-{run}", subject="Hello {{first_name}}", status="scheduled", segment_id=segment_id,
+                body="<p>Hi {{first_name}}, this is campaign run " + str(run) + ".</p>",
+            )
+            db.session.add(campaign)
+            db.session.commit()
+            campaign_id = campaign.id
+        started = time.perf_counter()
+        stats = app_module.send_campaign_emails(campaign_id, GRANT_ID)
+        latencies.append(time.perf_counter() - started)
+        for key in totals:
+            totals[key] += stats[key]
+        # Without injected faults every send must succeed; anything else means
+        # the fakes and the SDK disagree and the numbers would be meaningless
+        if not args.error_rate and not args.rate_limit_rate and stats["sent"] != audience:
+            raise RuntimeError(f"Campaign run {run} sent {stats['sent']} of {audience} messages "
+                               f"with no faults injected ({stats['failed']} failed)")
+    return summarize(latencies, items=totals["sent"], audience=audience, **totals)
+
+
+def bench_categorize(app_module, client, args):
+    latencies = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        job = wait_for_job(client, job_id_from(client.get("/nylas/categorize-emails")))
+        latencies.append(time.perf_counter() - started)
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"Categorization failed: {job['error']}")
+    messages = app_module.app.config["CATEGORIZE_MESSAGE_LIMIT"]
+    # The first run misses the category cache; later runs should hit it
+    return summarize(latencies, items=messages * len(latencies), cold_run_ms=round(1000 * latencies[0], 2))
+
+
+def bench_inbox(app_module, client, args):
+    list_latencies = []
+    view_latencies = []
+    for i in range(args.runs * 10):
+        started = time.perf_counter()
+        assert client.get("/nylas/recent-emails").status_code == 200
+        list_latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        assert client.get(f"/nylas/email/msg-{random.randrange(args.messages)}").status_code == 200
+        view_latencies.append(time.perf_counter() - started)
+    return {
+        "recent_emails": summarize(list_latencies),
+        "view_email": summarize(view_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=5000, help="CSV rows per import run")
+    parser.add_argument("--recipients", type=int, default=500, help="campaign audience size")
+    parser.add_argument("--messages", type=int, default=200, help="messages in the fake mailbox")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to each fake API call")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    random.seed(0)
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.rate_limit_rate)
+    nylas_server = FakeNylas(faults, messages=args.messages).start()
+    openai_server = FakeOpenAI(faults).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # app.py configures itself from the environment at import time
+        os.environ.update({
+            "NYLAS_API_URI": nylas_server.url,
+            "NYLAS_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{openai_server.url}/v1",
+            "OPENAI_API_KEY": "bench",
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "CAMPAIGN_SEND_RATE": "1000000",
+        })
+        import app as app_module
+
+        app_module.app.config["TESTING"] = True
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session["grant_id"] = GRANT_ID
+
+        benches = {
+            "import": bench_import,
+            "campaign": bench_campaign,
+            "categorize": bench_categorize,
+            "inbox": bench_inbox,
+        }
+        results = {}
+        for name in scenarios:
+            started = time.perf_counter()
+            results[name] = benches[name](app_module, client, args)
+            results[name]["wall_seconds"] = round(time.perf_counter() - started, 3)
+
+        app_module.scheduler_supervisor.stop()
+        with app_module.app.app_context():
+            app_module.db.engine.dispose()
+
+    nylas_server.stop()
+    openai_server.stop()
+    report = {
+        "commit": current_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "api_requests": {"nylas": nylas_server.requests, "openai": openai_server.requests},
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
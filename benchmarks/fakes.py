@@ -0,0 +1,272 @@
+# Local stand-ins for the Nylas v3 and OpenAI chat completions APIs, for
+# benchmarking without live accounts. Each server injects configurable
+# latency, 5xx errors and 429s (with Retry-After) on every request.
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class Faults:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=0.1):
+        self.latency = latency  # seconds added to every request
+        self.jitter = jitter  # +/- uniform seconds around latency
+        self.error_rate = error_rate  # fraction of requests answered with a 503
+        self.rate_limit_rate = rate_limit_rate  # fraction answered with a 429
+        self.retry_after = retry_after  # Retry-After sent with 429s
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def pick(self):
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 503
+        return None
+
+
+class FakeServer:
+    # Subclasses define routes: a list of (method, compiled path regex, handler
+    # name). Handlers take (match, query, body) and return (status, payload),
+    # or (status, iterable of bytes) for streamed responses.
+    routes = []
+
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes on a keep-alive
+            # connection; with Nagle's algorithm the body then waits for the
+            # client's delayed ACK, adding ~40ms to every request
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                with server.lock:
+                    server.requests += 1
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                time.sleep(server.faults.delay())
+                fault = server.faults.pick()
+                if fault is not None:
+                    return self._send_json(fault, server.error_payload(fault), {
+                        "Retry-After": str(server.faults.retry_after)
+                    } if fault == 429 else {})
+                url = urlparse(self.path)
+                for route_method, pattern, name in server.routes:
+                    match = pattern.fullmatch(url.path)
+                    if route_method == method and match:
+                        body = json.loads(raw) if raw else None
+                        status, payload = getattr(server, name)(match, parse_qs(url.query), body)
+                        if isinstance(payload, (dict, list)):
+                            return self._send_json(status, payload)
+                        return self._send_stream(status, payload)
+                self._send_json(404, server.error_payload(404))
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, status, chunks):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def error_payload(self, status):
+        return {"error": {"type": "fake_error", "message": f"Injected {status}"}}
+
+
+class FakeNylas(FakeServer):
+    routes = [
+        ("GET", re.compile(r"/v3/grants/([^/]+)/messages"), "list_messages"),
+        ("GET", re.compile(r"/v3/grants/([^/]+)/messages/([^/]+)"), "find_message"),
+        ("POST", re.compile(r"/v3/grants/([^/]+)/messages/send"), "send_message"),
+        ("POST", re.compile(r"/v3/grants/([^/]+)/drafts"), "create_draft"),
+        ("GET", re.compile(r"/v3/grants/([^/]+)/contacts"), "list_contacts"),
+    ]
+
+    def __init__(self, faults=None, messages=200, contacts=500, body_size=2000):
+        super().__init__(faults)
+        now = int(time.time())
+        self.messages = [self._message(i, now - 60 * i, body_size) for i in range(messages)]  # newest first
+        self.contacts = [
+            {"id": f"contact-{i}", "given_name": f"Contact {i}", "emails": [{"email": f"contact{i}@example.com"}]}
+            for i in range(contacts)
+        ]
+        self.sent = 0
+
+    def error_payload(self, status):
+        return {"request_id": uuid.uuid4().hex, "error": {"type": "fake_error", "message": f"Injected {status}"}}
+
+    @staticmethod
+    def _message(i, date, body_size):
+        words = ("meeting invoice project update newsletter offer schedule review report travel ").split()
+        body = " ".join(random.choice(words) for _ in range(body_size // 7))
+        return {
+            "id": f"msg-{i}",
+            "thread_id": f"thread-{i // 3}",
+            "subject": f"Message {i} about {random.choice(words)}",
+            "snippet": body[:120],
+            "body": f"<div><p>{body}</p></div>",
+            "from": [{"name": f"Sender {i % 40}", "email": f"sender{i % 40}@example.com"}],
+            "to": [{"name": "Me", "email": "me@example.com"}],
+            "date": date,
+        }
+
+    def _page(self, items, query, grant_id):
+        limit = int(query.get("limit", ["50"])[0])
+        start = int(query.get("page_token", ["0"])[0])
+        page = items[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(items) else None
+        return 200, {
+            "request_id": uuid.uuid4().hex,
+            "data": [dict(item, grant_id=grant_id) for item in page],
+            "next_cursor": next_cursor,
+        }
+
+    def list_messages(self, match, query, body):
+        messages = self.messages
+        if "received_after" in query:
+            received_after = int(query["received_after"][0])
+            messages = [m for m in messages if m["date"] > received_after]
+        return self._page(messages, query, match.group(1))
+
+    def find_message(self, match, query, body):
+        index = int(match.group(2).rsplit("-", 1)[-1])
+        if not 0 <= index < len(self.messages):
+            return 404, self.error_payload(404)
+        return 200, {"request_id": uuid.uuid4().hex, "data": dict(self.messages[index], grant_id=match.group(1))}
+
+    def send_message(self, match, query, body):
+        with self.lock:
+            self.sent += 1
+        # The full message object Nylas returns; the SDK requires fields such as "from"
+        now = int(time.time())
+        data = {
+            "object": "message", "id": uuid.uuid4().hex, "grant_id": match.group(1),
+            "thread_id": uuid.uuid4().hex, "subject": body.get("subject"), "body": body.get("body"),
+            "snippet": (body.get("body") or "")[:120], "from": [{"name": "Me", "email": "me@example.com"}],
+            "to": body.get("to") or [], "cc": body.get("cc") or [], "bcc": body.get("bcc") or [],
+            "reply_to": body.get("reply_to") or [], "attachments": [], "folders": ["SENT"],
+            "unread": False, "starred": False, "date": now, "created_at": now,
+        }
+        if body.get("send_at"):
+            data.update(send_at=body["send_at"], schedule_id=uuid.uuid4().hex)
+        return 200, {"request_id": uuid.uuid4().hex, "data": data}
+
+    def create_draft(self, match, query, body):
+        return 200, {"request_id": uuid.uuid4().hex, "data": dict(
+            body, object="draft", id=uuid.uuid4().hex, grant_id=match.group(1), date=int(time.time()),
+            **{"from": [{"name": "Me", "email": "me@example.com"}]},
+        )}
+
+    def list_contacts(self, match, query, body):
+        return self._page(self.contacts, query, match.group(1))
+
+
+class FakeOpenAI(FakeServer):
+    routes = [
+        ("POST", re.compile(r"/v1/chat/completions"), "chat_completion"),
+    ]
+    CATEGORIES = ("Work", "Personal", "Promotions", "Updates", "Finance")
+
+    def __init__(self, faults=None, tokens_per_second=0, prompt_tokens_per_second=0):
+        super().__init__(faults)
+        self.tokens_per_second = tokens_per_second  # 0 streams without delay
+        self.prompt_tokens_per_second = prompt_tokens_per_second  # prompt processing; 0 is instant
+
+    def _content(self, body):
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            # Batch categorization: answer for every index in the payload
+            try:
+                items = json.loads(body["messages"][-1]["content"])
+            except (ValueError, KeyError, TypeError):
+                items = []
+            return json.dumps({"categories": {
+                str(item.get("index", i)): random.choice(self.CATEGORIES) for i, item in enumerate(items)
+            }})
+        return "Hi {{first_name}}, thanks for reaching out. " + "Here is a short generated reply. " * 8
+
+    @staticmethod
+    def _usage(body, content):
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def chat_completion(self, match, query, body):
+        content = self._content(body)
+        if self.prompt_tokens_per_second:
+            time.sleep(self._usage(body, content)["prompt_tokens"] / self.prompt_tokens_per_second)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if not body.get("stream"):
+            return 200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": self._usage(body, content),
+            }
+
+        def chunks():
+            base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model")}
+            for word in re.findall(r"\S+\s*", content):
+                if self.tokens_per_second:
+                    time.sleep(1 / self.tokens_per_second)
+                yield self._event(dict(base, choices=[{"index": 0, "delta": {"content": word}, "finish_reason": None}]))
+            yield self._event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield self._event(dict(base, choices=[], usage=self._usage(body, content)))
+            yield b"data: [DONE]\n\n"
+
+        return 200, chunks()
+
+    @staticmethod
+    def _event(payload):
+        return f"data: {json.dumps(payload)}\n\n".encode()
@@ -0,0 +1,137 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+
+from email_text import clean_body, truncate_tokens
+from models import db, EmailCategory, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_MODEL = "gpt-4o-mini"
+# Bump when the prompt changes so cached categories from the old prompt are ignored
+PROMPT_VERSION = "v2"
+CACHE_VERSION = f"{CATEGORY_MODEL}:{PROMPT_VERSION}"
+FALLBACK_CATEGORY = "Other"
+
+CATEGORY_INSTRUCTIONS = (
+    "You are an email categorization assistant. Categorize emails into specific, concise categories "
+    "that can be used for grouping. Use categories like 'Work', 'Personal', 'Finance', 'Travel', "
+    "'Shopping', 'Social', 'News', 'Marketing', 'Education', etc. If none of these fit, create a "
+    "suitable category name."
+)
+BATCH_INSTRUCTIONS = CATEGORY_INSTRUCTIONS + (
+    " You will receive a JSON list of emails, each with an 'index', 'subject' and 'body'. "
+    "Respond with a JSON object of the form {\"categories\": {\"<index>\": \"<category>\"}} "
+    "containing one entry for every email and nothing else."
+)
+
+
+def iter_messages(nylas_client, grant_id, limit=100, page_size=50, request=None):
+    # Pages through nylas.messages.list with cursors, up to limit messages.
+    # request lets callers wrap the call (e.g. with nylas_retry).
+    request = request or (lambda func, *args: func(*args))
+    query_params = {"limit": min(page_size, limit)}
+    fetched = 0
+    while fetched < limit:
+        response = request(nylas_client.messages.list, grant_id, query_params)
+        for message in response.data[:limit - fetched]:
+            fetched += 1
+            yield message
+        if not response.next_cursor:
+            break
+        query_params = {"limit": min(page_size, limit - fetched), "page_token": response.next_cursor}
+
+
+def cached_categories(grant_id, message_ids, version=CACHE_VERSION, chunk_size=500):
+    categories = {}
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), chunk_size):
+        rows = db.session.execute(
+            select(EmailCategory.message_id, EmailCategory.category).where(
+                EmailCategory.grant_id == grant_id,
+                EmailCategory.version == version,
+                EmailCategory.message_id.in_(message_ids[start:start + chunk_size]),
+            )
+        )
+        categories.update(rows.all())
+    return categories
+
+
+def store_categories(grant_id, categories, version=CACHE_VERSION):
+    if not categories:
+        return
+    stmt = dialect_insert(EmailCategory.__table__).on_conflict_do_nothing(
+        index_elements=["grant_id", "message_id", "version"]
+    )
+    db.session.execute(stmt, [
+        {"grant_id": grant_id, "message_id": message_id, "version": version, "category": category}
+        for message_id, category in categories.items()
+    ])
+    db.session.commit()
+
+
+def categorize_batch(llm, messages, token_budget=100):
+    # messages is a list of (message_id, subject, body). One structured-output
+    # completion classifies the whole batch; each body is cleaned (see
+    # email_text.py) and cut to token_budget tokens.
+    payload = [
+        {"index": i, "subject": subject or "", "body": truncate_tokens(clean_body(body), token_budget, CATEGORY_MODEL)}
+        for i, (_, subject, body) in enumerate(messages)
+    ]
+    content = llm.complete(
+        "categorize_batch",
+        model=CATEGORY_MODEL,
+        messages=[
+            {"role": "system", "content": BATCH_INSTRUCTIONS},
+            {"role": "user", "content": json.dumps(payload)}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.3
+    )
+    try:
+        by_index = json.loads(content)["categories"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Unparseable categorization response for %s messages", len(messages))
+        by_index = {}
+    categories = {}
+    for i, (message_id, _, _) in enumerate(messages):
+        category = str(by_index.get(str(i)) or "").strip()[:100]
+        categories[message_id] = category or None
+    return categories
+
+
+def categorize_messages(llm, grant_id, messages, batch_size=20, workers=4, progress=None, token_budget=100):
+    # Returns {message_id: category}. Cached categories are reused; the rest are
+    # classified in batches that run concurrently, then cached in one insert.
+    messages = [(m.id, m.subject, getattr(m, "body", None) or m.snippet) for m in messages]
+    categories = cached_categories(grant_id, (message_id for message_id, _, _ in messages))
+    missing = [m for m in messages if m[0] not in categories]
+    done = len(messages) - len(missing)
+    if progress:
+        progress(done, len(messages))
+    if not missing:
+        return categories
+
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    fresh = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="categorize") as executor:
+        for batch, result in zip(batches, executor.map(lambda b: _categorize_or_skip(llm, b, token_budget), batches)):
+            fresh.update(result)
+            done += len(batch)
+            if progress:
+                progress(done, len(messages))
+    # Messages the model skipped or that errored are shown as FALLBACK_CATEGORY
+    # but not cached, so the next run tries them again.
+    store_categories(grant_id, {k: v for k, v in fresh.items() if v})
+    categories.update({k: v or FALLBACK_CATEGORY for k, v in fresh.items()})
+    return categories
+
+
+def _categorize_or_skip(llm, batch, token_budget):
+    try:
+        return categorize_batch(llm, batch, token_budget)
+    except Exception as e:
+        logger.error("Error categorizing batch of %s emails: %s", len(batch), e)
+        return {message_id: None for message_id, _, _ in batch}
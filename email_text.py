@@ -0,0 +1,169 @@
+import logging
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to an estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARKER = "\n[...]"
+CHARS_PER_TOKEN = 4  # rough average for English text, used without tiktoken
+
+# Elements whose content never belongs in a prompt: markup, quoted replies
+# and signatures as Gmail, Yahoo, Thunderbird, Apple Mail and Proton mark them.
+SKIP_TAGS = {"head", "script", "style", "title", "blockquote"}
+SKIP_CLASSES = {"gmail_quote", "gmail_signature", "gmail_extra", "yahoo_quoted", "moz-cite-prefix",
+                "moz-signature", "protonmail_quote", "protonmail_signature_block", "AppleOriginalContents"}
+SKIP_IDS = {"Signature"}
+# Outlook doesn't wrap the quoted message: everything from these elements on is quoted
+CUT_IDS = {"divRplyFwdMsg", "appendonsend"}
+BLOCK_TAGS = {"address", "article", "br", "dd", "div", "dl", "dt", "footer", "h1", "h2", "h3", "h4", "h5",
+              "h6", "header", "hr", "li", "ol", "p", "pre", "section", "table", "tr", "ul"}
+HTML_PATTERN = re.compile(r"<(?:html|body|div|p|br|table|span|a)\b", re.IGNORECASE)
+
+# A line that starts the quoted part of a plain-text reply
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r"^On\b.{0,300}\bwrote:$", re.IGNORECASE | re.DOTALL),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}$", re.IGNORECASE),
+    re.compile(r"^_{10,}$"),  # Outlook's separator above the quoted headers
+]
+OUTLOOK_HEADER = re.compile(r"^From:\s.+", re.IGNORECASE)
+OUTLOOK_HEADER_FIELDS = re.compile(r"^(Sent|Date|To|Subject):\s", re.IGNORECASE)
+SIGNATURE_PATTERNS = [
+    re.compile(r"^--\s?$"),
+    re.compile(r"^Sent from my \w+", re.IGNORECASE),
+    re.compile(r"^Get Outlook for \w+", re.IGNORECASE),
+]
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_tag = None
+        self.skip_depth = 0
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        if attrs.get("id") in CUT_IDS:
+            self.done = True
+        elif tag in SKIP_TAGS or classes & SKIP_CLASSES or attrs.get("id") in SKIP_IDS:
+            # Only the skipped tag itself is counted, so unclosed <p>s and <li>s
+            # inside it can't leave the parser skipping the rest of the document
+            self.skip_tag, self.skip_depth = tag, 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag == "td":
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    self.skip_tag = None
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_tag and not self.done:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def normalize_whitespace(text):
+    lines = [" ".join(line.split()) for line in text.replace("\r\n", "\n").replace("\xa0", " ").split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def strip_quoted(text):
+    # Cuts a plain-text reply at the first quote header or signature delimiter
+    # and drops ">"-quoted lines.
+    lines = text.split("\n")
+    kept = []
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        # Clients wrap long "On ... wrote:" lines, so also try it joined with the next one
+        joined = f"{stripped} {lines[index + 1].strip()}" if index + 1 < len(lines) else stripped
+        if any(pattern.match(stripped) or pattern.match(joined) for pattern in QUOTE_HEADER_PATTERNS):
+            break
+        if OUTLOOK_HEADER.match(stripped) and any(
+            OUTLOOK_HEADER_FIELDS.match(following.strip()) for following in lines[index + 1:index + 4]
+        ):
+            break
+        if any(pattern.match(stripped) for pattern in SIGNATURE_PATTERNS):
+            break
+        if stripped.startswith(">"):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def clean_body(body):
+    # The text an LLM needs from an email body: HTML converted to text, with
+    # quoted replies and signatures removed. Falls back to the full text when
+    # nothing but quotes would be left (e.g. a bare forward).
+    body = body or ""
+    text = normalize_whitespace(html_to_text(body) if HTML_PATTERN.search(body) else body)
+    return normalize_whitespace(strip_quoted(text)) or text
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # the BPE files are fetched on first use
+        logger.warning("No tokenizer for %s, estimating token counts: %s", model, e)
+        return None
+
+
+def has_tokenizer(model="gpt-4o-mini"):
+    # False when token counts are estimated from length
+    return _encoding(model) is not None
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, budget, model="gpt-4o-mini"):
+    # Keeps the start of the text: after clean_body that is the newest message
+    encoding = _encoding(model)
+    if encoding is None:
+        limit = budget * CHARS_PER_TOKEN
+        if len(text) <= limit:
+            return text
+        cut = text.rfind(" ", 0, limit)
+        return text[:cut if cut > limit // 2 else limit] + TRUNCATION_MARKER
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= budget:
+        return text
+    return encoding.decode(tokens[:budget]) + TRUNCATION_MARKER
@@ -0,0 +1,126 @@
+import csv
+import re
+from itertools import islice
+
+from sqlalchemy import select
+
+from models import db, Recipient, dialect_insert
+
+# Dot-atom local part and a hostname of at least two labels; checked after
+# lowercasing. Stricter than RFC 5322, but catches what bounces in practice.
+EMAIL_PATTERN = re.compile(
+    r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$"
+)
+NAME_MAX_LENGTH = Recipient.__table__.c.name.type.length
+EMAIL_MAX_LENGTH = Recipient.__table__.c.email.type.length
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.suppressed = 0
+        self.processed = 0
+
+    def as_dict(self):
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+            "suppressed": self.suppressed,
+        }
+
+
+def normalize_email(email):
+    email = (email or "").strip().lower()
+    if len(email) > EMAIL_MAX_LENGTH or not EMAIL_PATTERN.match(email):
+        return None
+    return email
+
+
+def normalize_name(name):
+    return (name or "").strip()[:NAME_MAX_LENGTH]
+
+
+def _upsert_statement():
+    stmt = dialect_insert(Recipient.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["email"],
+        set_={"name": stmt.excluded.name},
+    )
+
+
+def _write_chunk(rows, repeated, result):
+    # One SELECT to split inserts from updates for reporting, then one
+    # executemany upsert for the whole chunk. Emails already written by an
+    # earlier chunk of this import are counted as duplicates only.
+    existing = set(db.session.execute(
+        select(Recipient.email).where(Recipient.email.in_(list(rows)))
+    ).scalars())
+    db.session.execute(
+        _upsert_statement(),
+        [{"name": name, "email": email} for email, name in rows.items()],
+    )
+    result.updated += len(existing - repeated)
+    result.inserted += len(rows) - len(existing)
+
+
+def bulk_upsert_recipients(pairs, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, suppressions=None):
+    # pairs is any iterable of (name, email). Rows are validated and deduped in
+    # memory (last name wins) and written chunk by chunk, committing each one.
+    # Addresses on the suppression list (a SuppressionList), if given, are
+    # skipped. progress, if given, is called with the running ImportResult per chunk.
+    result = ImportResult()
+    pairs = iter(pairs)
+    seen = set()
+    while True:
+        chunk = list(islice(pairs, chunk_size))
+        if not chunk:
+            break
+        rows = {}
+        repeated = set()
+        for name, email in chunk:
+            email = normalize_email(email)
+            name = normalize_name(name)
+            if not email or not name:
+                result.rejected += 1
+                continue
+            if email in rows or email in seen:
+                result.duplicates += 1
+                if email in seen:
+                    repeated.add(email)
+            rows[email] = name
+        if rows and suppressions is not None:
+            for email in suppressions.suppressed_among(list(rows)):
+                del rows[email]
+                result.suppressed += 1
+        if rows:
+            _write_chunk(rows, repeated, result)
+            db.session.commit()
+            seen.update(rows)
+        result.processed += len(chunk)
+        if progress:
+            progress(result)
+    return result
+
+
+def iter_csv_rows(text_stream):
+    reader = csv.DictReader(text_stream)
+    if reader.fieldnames:
+        reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+    for row in reader:
+        yield row.get("name"), row.get("email")
+
+
+def iter_contact_rows(contacts):
+    for contact in contacts:
+        full_name = " ".join(part for part in (contact.given_name, contact.surname) if part)
+        for contact_email in contact.emails or []:
+            email = getattr(contact_email, "email", contact_email)
+            yield full_name or email, email
@@ -0,0 +1,154 @@
+import json
+import logging
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    # Handed to every task so it can report progress. Progress writes are
+    # throttled so tight loops don't turn into a commit per item.
+    def __init__(self, job_id, min_interval=0.5):
+        self.id = job_id
+        self.min_interval = min_interval
+        self.last_write = 0.0
+
+    def update(self, progress=None, total=None, message=None, force=False):
+        now = time.monotonic()
+        finished = progress is not None and progress == total
+        if not force and not finished and now - self.last_write < self.min_interval:
+            return
+        values = {}
+        if progress is not None:
+            values["progress"] = progress
+        if total is not None:
+            values["total"] = total
+        if message is not None:
+            values["message"] = message[:255]
+        if values:
+            db.session.execute(update(Job).where(Job.id == self.id).values(**values))
+            db.session.commit()
+        self.last_write = now
+
+
+class JobQueue:
+    # Jobs are persisted in the job table and executed by a local thread pool.
+    # Claiming a job is a conditional UPDATE, so when several processes share
+    # the database each job still runs exactly once. A job still 'running'
+    # timeout seconds after it started belonged to a process that died; it is
+    # marked failed when the queue starts.
+    def __init__(self, app=None, workers=4, timeout=6 * 3600):
+        self.tasks = {}
+        self.failure_handlers = {}
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = None
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get("JOB_WORKERS", self.workers)
+        self.timeout = app.config.get("JOB_TIMEOUT", self.timeout)
+        app.extensions["jobs"] = self
+
+    def task(self, kind, on_failure=None):
+        # on_failure(**params) runs when the task raises or its job is found
+        # stale, so tasks can undo state they left half-done
+        def decorator(func):
+            self.tasks[kind] = func
+            if on_failure:
+                self.failure_handlers[kind] = on_failure
+            return func
+        return decorator
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        with self.app.app_context():
+            self._fail_stale()
+        # Pick up anything that was queued but never started before a restart
+        with self.app.app_context():
+            queued = db.session.execute(
+                db.select(Job.id).where(Job.status == 'queued').order_by(Job.created_at)
+            ).scalars().all()
+        for job_id in queued:
+            self.executor.submit(self._run, job_id)
+
+    def enqueue(self, kind, **params):
+        if kind not in self.tasks:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(id=uuid.uuid4().hex, kind=kind, status='queued', params=json.dumps(params))
+        db.session.add(job)
+        db.session.commit()
+        self.executor.submit(self._run, job.id)
+        return job.id
+
+    def get(self, job_id):
+        return db.session.get(Job, job_id)
+
+    def _claim(self, job_id):
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def _finish(self, job_id, **values):
+        db.session.rollback()
+        db.session.execute(
+            update(Job).where(Job.id == job_id).values(finished_at=datetime.utcnow(), **values)
+        )
+        db.session.commit()
+
+    def _fail_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.timeout)
+        stale = db.session.execute(
+            db.select(Job.id, Job.kind, Job.params).where(Job.status == 'running', Job.started_at < cutoff)
+        ).all()
+        for job_id, kind, params in stale:
+            failed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'running')
+                .values(status='failed', error="Interrupted: the process running this job stopped",
+                        finished_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if failed:
+                logger.warning("Marked stale job %s (%s) as failed", job_id, kind)
+                self._on_failure(kind, json.loads(params or "{}"))
+
+    def _on_failure(self, kind, params):
+        handler = self.failure_handlers.get(kind)
+        if handler is None:
+            return
+        try:
+            handler(**params)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.error("Failure handler for %s failed:\n%s", kind, traceback.format_exc())
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            if not self._claim(job_id):
+                return
+            job = db.session.get(Job, job_id)
+            kind, params = job.kind, json.loads(job.params or "{}")
+            try:
+                result = self.tasks[kind](JobContext(job_id), **params)
+                self._finish(job_id, status='succeeded', result=json.dumps(result))
+            except Exception as e:
+                logger.error("Job %s (%s) failed:\n%s", job_id, kind, traceback.format_exc())
+                self._finish(job_id, status='failed', error=str(e))
+                self._on_failure(kind, params)
@@ -0,0 +1,166 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update, func, bindparam, literal
+
+from models import db, Recipient, CampaignDelivery, dialect_insert
+from segments import iter_audience_ids
+
+UNDELIVERED_STATUSES = ('pending', 'failed')
+
+
+def undelivered():
+    # status IN ('pending', 'failed') with the values inlined: SQLite only uses
+    # the partial ix_delivery_undelivered index when the condition matches it
+    # literally, never with bound parameters
+    return CampaignDelivery.status.in_([literal(status, literal_execute=True) for status in UNDELIVERED_STATUSES])
+
+
+def seed_deliveries(campaign_id, segment=None):
+    # Add a pending row for every recipient in the campaign's audience that is
+    # not yet in its ledger. Ids are streamed in chunks and each chunk is its
+    # own short transaction; rows already tracked are skipped by the unique
+    # (campaign_id, recipient_id) constraint.
+    insert_pending = dialect_insert(CampaignDelivery.__table__).on_conflict_do_nothing(
+        index_elements=['campaign_id', 'recipient_id']
+    )
+    for ids in iter_audience_ids(segment):
+        db.session.execute(insert_pending, [
+            {"campaign_id": campaign_id, "recipient_id": recipient_id, "status": 'pending', "attempts": 0}
+            for recipient_id in ids
+        ])
+        db.session.commit()
+
+
+def reset_deliveries(campaign_id):
+    # Recurring campaigns start each run from a clean ledger
+    db.session.execute(
+        update(CampaignDelivery)
+        .where(CampaignDelivery.campaign_id == campaign_id)
+        .values(status='pending', attempts=0, provider_message_id=None, provider_schedule_id=None, last_error=None)
+    )
+    db.session.commit()
+
+
+def count_undelivered(campaign_id, max_attempts=None):
+    query = select(func.count(CampaignDelivery.id)).where(
+        CampaignDelivery.campaign_id == campaign_id,
+        undelivered(),
+    )
+    if max_attempts is not None:
+        query = query.where(CampaignDelivery.attempts < max_attempts)
+    return db.session.execute(query).scalar()
+
+
+def delivery_counts(campaign_ids):
+    # {campaign_id: {status: count}} for the given campaigns, in one grouped query
+    rows = db.session.execute(
+        select(CampaignDelivery.campaign_id, CampaignDelivery.status, func.count(CampaignDelivery.id))
+        .where(CampaignDelivery.campaign_id.in_(list(campaign_ids)))
+        .group_by(CampaignDelivery.campaign_id, CampaignDelivery.status)
+    )
+    counts = {}
+    for campaign_id, status, count in rows:
+        counts.setdefault(campaign_id, {})[status] = count
+    return counts
+
+
+def iter_pending(campaign_id, max_attempts, chunk_size=500):
+    # Walks the partial (campaign_id, id) index of undelivered rows with keyset
+    # pagination, so each chunk reads only its own rows in index order and a
+    # resumed campaign only touches rows that still need delivering.
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(
+                CampaignDelivery.id,
+                CampaignDelivery.attempts,
+                Recipient.id,
+                Recipient.name,
+                Recipient.email,
+            )
+            .join(Recipient, Recipient.id == CampaignDelivery.recipient_id)
+            .where(
+                CampaignDelivery.campaign_id == campaign_id,
+                undelivered(),
+                CampaignDelivery.attempts < max_attempts,
+                CampaignDelivery.id > last_id,
+            )
+            .order_by(CampaignDelivery.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1][0]
+
+
+class DeliveryRecorder:
+    # Buffers per-recipient send results and writes them with one executemany
+    # UPDATE per batch. A crash can lose at most one unflushed batch, which is
+    # then re-sent on resume; flush_interval bounds that window in time too.
+    # Pre-staged campaigns record accepted messages as 'staged' rather than 'sent'.
+    # Sends whose outcome is unknown are recorded as failed with max_attempts
+    # used up, so they are left for an operator instead of being resent.
+    def __init__(self, batch_size=200, flush_interval=2.0, accepted_status='sent', max_attempts=None):
+        self.batch_size = batch_size
+        self.accepted_status = accepted_status
+        self.max_attempts = max_attempts
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def record(self, delivery_id, previous_attempts, result):
+        attempts = previous_attempts + result.attempts
+        error = None if result.ok else str(result.error)
+        if result.outcome_unknown and self.max_attempts is not None:
+            attempts = max(attempts, self.max_attempts)
+            error = f"May have been sent; not retried: {error}"
+        self.buffer.append({
+            "b_id": delivery_id,
+            "b_status": self.accepted_status if result.ok else 'failed',
+            "b_attempts": attempts,
+            "b_message_id": result.message_id,
+            "b_schedule_id": result.schedule_id,
+            "b_error": error[:1000] if error else None,
+            "b_updated_at": datetime.utcnow(),
+        })
+        self._maybe_flush()
+
+    def record_suppressed(self, delivery_id, previous_attempts):
+        # Recipient is on the suppression list: settled without sending
+        self.buffer.append({
+            "b_id": delivery_id,
+            "b_status": 'suppressed',
+            "b_attempts": previous_attempts,
+            "b_message_id": None,
+            "b_schedule_id": None,
+            "b_error": None,
+            "b_updated_at": datetime.utcnow(),
+        })
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            table = CampaignDelivery.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.id == bindparam("b_id"))
+                .values(
+                    status=bindparam("b_status"),
+                    attempts=bindparam("b_attempts"),
+                    provider_message_id=bindparam("b_message_id"),
+                    provider_schedule_id=bindparam("b_schedule_id"),
+                    last_error=bindparam("b_error"),
+                    updated_at=bindparam("b_updated_at"),
+                ),
+                self.buffer,
+            )
+            db.session.commit()
+            self.buffer = []
+        self.last_flush = time.monotonic()
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func
+
+import metrics
+import resilience
+from models import db, LLMCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model, messages, params):
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _timeout_param(timeout):
+    # An explicit timeout=None would turn the client's timeout off altogether
+    return {} if timeout is None else {"timeout": timeout}
+
+
+class CallSiteStats:
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / self.calls, 3) if self.calls else 0.0,
+            "avg_latency_ms": round(1000 * self.latency_total / self.calls, 1) if self.calls else 0.0,
+            "max_latency_ms": round(1000 * self.latency_max, 1),
+        }
+
+
+class LLMGateway:
+    # Single entry point for chat completions. Responses are cached in the
+    # llm_cache_entry table (TTL + LRU eviction by last access) behind a small
+    # in-process LRU, and identical requests that are already in flight share
+    # one upstream call.
+    def __init__(self, client, app=None, ttl=7 * 24 * 3600, max_entries=10000, memory_entries=256):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.in_flight = {}
+        self.call_sites = {}
+        self.lock = threading.Lock()
+        self.writes_since_eviction = 0
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get("LLM_CACHE_TTL", self.ttl)
+        self.max_entries = app.config.get("LLM_CACHE_MAX_ENTRIES", self.max_entries)
+        app.extensions["llm"] = self
+
+    def complete(self, call_site, model, messages, cache=True, **params):
+        # Returns the stripped text of the first choice. Errors propagate and
+        # are never cached.
+        started = time.perf_counter()
+        key = cache_key(model, messages, params)
+        if cache:
+            text = self._lookup(key)
+            if text is not None:
+                self._record(call_site, "hits", started)
+                return text
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+        if not leader:
+            try:
+                text = future.result()
+            except Exception:
+                self._record(call_site, "errors", started)
+                raise
+            self._record(call_site, "shared", started)
+            return text
+
+        def create(timeout):
+            with metrics.llm_call(call_site, model):
+                return self.client.chat.completions.create(
+                    model=model, messages=messages, **_timeout_param(timeout), **params
+                )
+
+        try:
+            response = self._call(call_site, create)
+            metrics.record_llm_usage(call_site, model, getattr(response, "usage", None))
+            text = response.choices[0].message.content.strip()
+            if cache:
+                self._store(key, model, text)
+            future.set_result(text)
+        except Exception as e:
+            future.set_exception(e)
+            self._record(call_site, "errors", started)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+        self._record(call_site, "misses", started)
+        return text
+
+    def stream(self, call_site, model, messages, cache=True, **params):
+        # Generator of text chunks. A cached response comes back as a single
+        # chunk; otherwise tokens are yielded as they arrive and the assembled
+        # text is cached under the same key complete() would use.
+        started = time.perf_counter()
+        key = cache_key(model, messages, params)
+        if cache:
+            text = self._lookup(key)
+            if text is not None:
+                self._record(call_site, "hits", started)
+                yield text
+                return
+
+        def create(timeout):
+            # include_usage adds a final chunk with token counts and no choices.
+            # For a stream the timeout bounds each read, not the whole response.
+            return self.client.chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True},
+                **_timeout_param(timeout), **params
+            )
+
+        chunks = []
+        try:
+            with metrics.llm_call(call_site, model):
+                # Only opening the stream is retried; tokens already sent can't be
+                for chunk in self._call(call_site, create):
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+                    metrics.record_llm_usage(call_site, model, getattr(chunk, "usage", None))
+        except Exception:
+            self._record(call_site, "errors", started)
+            raise
+        text = "".join(chunks).strip()
+        if cache and text:
+            self._store(key, model, text)
+        self._record(call_site, "misses", started)
+
+    def _call(self, call_site, create):
+        return resilience.call(
+            create,
+            policy=resilience.default_policy(interactive=resilience.INTERACTIVE_LLM),
+            breaker=resilience.get_breaker("openai:chat.completions"),
+            on_retry=lambda error, delay: metrics.LLM_RETRIES.inc(call_site=call_site),
+        )
+
+    def stats(self):
+        with self.lock:
+            return {call_site: stats.as_dict() for call_site, stats in self.call_sites.items()}
+
+    def _record(self, call_site, outcome, started):
+        elapsed = time.perf_counter() - started
+        metrics.LLM_COMPLETIONS.inc(call_site=call_site, outcome=outcome)
+        with self.lock:
+            stats = self.call_sites.setdefault(call_site, CallSiteStats())
+            stats.calls += 1
+            setattr(stats, outcome, getattr(stats, outcome) + 1)
+            stats.latency_total += elapsed
+            stats.latency_max = max(stats.latency_max, elapsed)
+
+    def _remember(self, key, text, expires_at):
+        with self.lock:
+            self.memory[key] = (text, expires_at)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def _lookup(self, key):
+        now = datetime.utcnow()
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached and cached[1] > now:
+                self.memory.move_to_end(key)
+                return cached[0]
+        # Cache IO runs in its own app context (and session), so it works from
+        # worker threads and never commits the caller's pending changes.
+        with self.app.app_context():
+            entry = db.session.execute(
+                select(LLMCacheEntry.response, LLMCacheEntry.expires_at, LLMCacheEntry.last_accessed)
+                .where(LLMCacheEntry.key == key)
+            ).first()
+            if entry is None or entry.expires_at <= now:
+                return None
+            # Only touch last_accessed occasionally to keep hits read-mostly
+            if entry.last_accessed is None or now - entry.last_accessed > timedelta(minutes=1):
+                db.session.execute(update(LLMCacheEntry).where(LLMCacheEntry.key == key).values(last_accessed=now))
+                db.session.commit()
+        self._remember(key, entry.response, entry.expires_at)
+        return entry.response
+
+    def _store(self, key, model, text):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        try:
+            with self.app.app_context():
+                db.session.merge(LLMCacheEntry(
+                    key=key, model=model, response=text,
+                    created_at=now, expires_at=expires_at, last_accessed=now,
+                ))
+                db.session.commit()
+                with self.lock:
+                    self.writes_since_eviction += 1
+                    evict = self.writes_since_eviction >= 100
+                    if evict:
+                        self.writes_since_eviction = 0
+                if evict:
+                    self.evict()
+        except Exception as e:
+            logger.warning("Could not store LLM response in cache: %s", e)
+        self._remember(key, text, expires_at)
+
+    def evict(self):
+        # Drops expired entries, then the least recently used ones above
+        # max_entries. Runs every 100 writes rather than on each one.
+        db.session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.expires_at <= datetime.utcnow()))
+        count = db.session.execute(select(func.count()).select_from(LLMCacheEntry)).scalar()
+        if count > self.max_entries:
+            cutoff = (
+                select(LLMCacheEntry.key)
+                .order_by(LLMCacheEntry.last_accessed)
+                .limit(count - self.max_entries)
+            )
+            db.session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(cutoff)))
+        db.session.commit()
@@ -0,0 +1,165 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import case
+
+from email_text import clean_body
+from models import db, CachedMessage, MessageSyncState, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# Re-fetch a little before the newest message we have, in case messages with
+# the same timestamp arrived after the last sync.
+SYNC_OVERLAP_SECONDS = 60
+
+
+def _participants_json(participants):
+    return json.dumps([
+        {"name": getattr(p, "name", None), "email": getattr(p, "email", None)}
+        for p in participants or []
+    ])
+
+
+def _message_row(grant_id, message):
+    return {
+        "grant_id": grant_id,
+        "id": message.id,
+        "thread_id": getattr(message, "thread_id", None),
+        "subject": message.subject,
+        "snippet": message.snippet,
+        "from_json": _participants_json(message.from_),
+        "to_json": _participants_json(message.to),
+        "body": message.body,
+        "body_text": None,  # computed on first use
+        "date": message.date,
+        "synced_at": datetime.utcnow(),
+    }
+
+
+class MessageStore:
+    # Local copy of each grant's recent messages. Pages read from the
+    # cached_message table; a stale store is refreshed in the background with
+    # an incremental sync (received_after the newest message seen + cursor
+    # paging), and an invalidated one is refreshed before returning.
+    def __init__(self, nylas_client, app=None, request=None, ttl=60, initial_limit=50, page_size=50, max_pages=10):
+        self.nylas = nylas_client
+        self.request = request or (lambda func, *args: func(*args))
+        self.ttl = ttl
+        self.initial_limit = initial_limit
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="message-sync")
+        self.syncing = set()
+        self.lock = threading.Lock()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get("MESSAGE_CACHE_TTL", self.ttl)
+        app.extensions["message_store"] = self
+
+    def recent(self, grant_id, limit=50):
+        state = db.session.get(MessageSyncState, grant_id)
+        if state is None or state.synced_at is None:
+            self.sync(grant_id)
+        elif datetime.utcnow() - state.synced_at > timedelta(seconds=self.ttl):
+            self.sync_in_background(grant_id)
+        return (
+            CachedMessage.query
+            .filter_by(grant_id=grant_id)
+            .order_by(CachedMessage.date.desc())
+            .limit(limit)
+            .all()
+        )
+
+    def get(self, grant_id, message_id):
+        message = db.session.get(CachedMessage, (grant_id, message_id))
+        if message is None or message.body is None:
+            # Don't hold a database transaction open across the API call
+            db.session.rollback()
+            response = self.request(self.nylas.messages.find, grant_id, message_id)
+            self._upsert(grant_id, [response.data])
+            db.session.commit()
+            message = db.session.get(CachedMessage, (grant_id, message_id), populate_existing=True)
+        return message
+
+    def body_text(self, message):
+        # The body with HTML, quoted replies and signatures stripped, as used in
+        # LLM prompts. Cleaned once per message and kept on its cached row.
+        if message.body_text is None:
+            message.body_text = clean_body(message.body)
+            db.session.commit()
+        return message.body_text
+
+    def invalidate(self, grant_id):
+        state = db.session.get(MessageSyncState, grant_id)
+        if state is not None:
+            state.synced_at = None
+            db.session.commit()
+
+    def sync_in_background(self, grant_id):
+        with self.lock:
+            if grant_id in self.syncing:
+                return
+            self.syncing.add(grant_id)
+        self.executor.submit(self._background_sync, grant_id)
+
+    def _background_sync(self, grant_id):
+        try:
+            with self.app.app_context():
+                self.sync(grant_id)
+        except Exception as e:
+            logger.error("Message sync failed for grant %s: %s", grant_id, e)
+        finally:
+            with self.lock:
+                self.syncing.discard(grant_id)
+
+    def sync(self, grant_id):
+        state = db.session.get(MessageSyncState, grant_id)
+        if state is None:
+            state = MessageSyncState(grant_id=grant_id)
+            db.session.add(state)
+        latest_date = state.latest_date
+        if latest_date:
+            query_params = {"limit": self.page_size, "received_after": latest_date - SYNC_OVERLAP_SECONDS}
+            max_pages = self.max_pages
+        else:
+            # First sync: just the most recent messages
+            query_params = {"limit": self.initial_limit}
+            max_pages = 1
+        db.session.commit()
+        synced = 0
+        for _ in range(max_pages):
+            response = self.request(self.nylas.messages.list, grant_id, query_params)
+            messages = response.data
+            if messages:
+                # One short write per page, never spanning the next API call
+                self._upsert(grant_id, messages)
+                db.session.commit()
+                synced += len(messages)
+                latest_date = max([latest_date or 0] + [m.date or 0 for m in messages])
+            if not response.next_cursor:
+                break
+            query_params = dict(query_params, page_token=response.next_cursor)
+        state.latest_date = latest_date
+        state.synced_at = datetime.utcnow()
+        db.session.commit()
+        return synced
+
+    def _upsert(self, grant_id, messages):
+        table = CachedMessage.__table__
+        stmt = dialect_insert(table)
+        # Re-synced messages keep their cleaned text unless the body changed
+        body_text_unless_changed = case((table.c.body == stmt.excluded.body, table.c.body_text), else_=None)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["grant_id", "id"],
+            set_={**{column: stmt.excluded[column] for column in (
+                "thread_id", "subject", "snippet", "from_json", "to_json", "body", "date", "synced_at"
+            )}, "body_text": body_text_unless_changed},
+        )
+        db.session.execute(stmt, [_message_row(grant_id, message) for message in messages])
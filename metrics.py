@@ -0,0 +1,237 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(series) for key, series in self.values.items()}
+        for key, series in sorted(values.items()):
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', bound)])} {count}"
+            yield f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route.", ("endpoint", "method", "status"))
+NYLAS_REQUEST_SECONDS = registry.histogram(
+    "nylas_request_duration_seconds", "Nylas API call latency, per attempt.", ("operation", "outcome"))
+NYLAS_ERRORS = registry.counter(
+    "nylas_errors_total", "Failed Nylas API attempts, by HTTP status (none for transport errors).",
+    ("operation", "status"))
+NYLAS_RETRIES = registry.counter(
+    "nylas_retries_total", "Nylas API calls retried after a failed attempt.", ("operation",))
+CIRCUIT_OPENED = registry.counter(
+    "circuit_breaker_opened_total", "Times a circuit breaker opened, by upstream endpoint.", ("circuit",))
+LLM_RETRIES = registry.counter(
+    "llm_retries_total", "Chat completion calls retried after a failed attempt.", ("call_site",))
+LLM_REQUEST_SECONDS = registry.histogram(
+    "llm_request_duration_seconds", "Upstream chat completion latency (cache misses only).",
+    ("call_site", "model", "outcome"))
+LLM_COMPLETIONS = registry.counter(
+    "llm_completions_total", "Chat completions by outcome: hits, misses, shared (in-flight) or errors.",
+    ("call_site", "outcome"))
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Tokens reported by the API, by kind (prompt or completion).",
+    ("call_site", "model", "kind"))
+
+
+# Tracing: when enabled, each request collects the spans opened while it is
+# handled (Nylas and OpenAI calls) and logs them as one JSON line.
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def start_trace(name):
+    _trace.set({"name": name, "started": time.perf_counter(), "spans": []})
+
+
+def finish_trace(**attributes):
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+    record = {
+        "trace": trace["name"],
+        "duration_ms": round(1000 * (time.perf_counter() - trace["started"]), 2),
+        **attributes,
+        "spans": trace["spans"],
+    }
+    logger.info(json.dumps(record))
+    return record
+
+
+@contextmanager
+def span(name, **attributes):
+    trace = _trace.get()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        if trace is not None:
+            trace["spans"].append({
+                "name": name,
+                "offset_ms": round(1000 * (started - trace["started"]), 2),
+                "duration_ms": round(1000 * (time.perf_counter() - started), 2),
+                **attributes,
+                **({"error": error} if error else {}),
+            })
+
+
+def nylas_operation(func):
+    # e.g. nylas.messages.send -> "messages.send"
+    owner = getattr(func, "__self__", None)
+    name = getattr(func, "__name__", "call")
+    return f"{type(owner).__name__.lower()}.{name}" if owner is not None else name
+
+
+@contextmanager
+def nylas_call(operation):
+    started = time.perf_counter()
+    try:
+        with span(f"nylas {operation}"):
+            yield
+    except Exception as e:
+        NYLAS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome="error")
+        NYLAS_ERRORS.inc(operation=operation, status=getattr(e, "status_code", None) or "none")
+        raise
+    NYLAS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome="ok")
+
+
+@contextmanager
+def llm_call(call_site, model):
+    started = time.perf_counter()
+    try:
+        with span(f"llm {call_site}", model=model):
+            yield
+    except Exception:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, call_site=call_site, model=model, outcome="error")
+        raise
+    LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, call_site=call_site, model=model, outcome="ok")
+
+
+def record_llm_usage(call_site, model, usage):
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, call_site=call_site, model=model, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, call_site=call_site, model=model, kind="completion")
+
+
+def init_app(app):
+    # Times every request by route, and traces it when TRACE_REQUESTS is set.
+    # Streaming responses are timed until their headers are ready.
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        if app.config.get("TRACE_REQUESTS"):
+            start_trace(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                endpoint=request.endpoint or "unmatched",
+                method=request.method,
+                status=response.status_code,
+            )
+        if app.config.get("TRACE_REQUESTS"):
+            finish_trace(status=response.status_code)
+        return response
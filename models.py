@@ -1,25 +1,376 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.schema import CreateIndex
 from datetime import datetime
+from types import SimpleNamespace
+import json
 
 db = SQLAlchemy()
 
+
+def _index_names(connection, inspector, table_name):
+    if connection.dialect.name == "sqlite":
+        # SQLite doesn't reflect expression indexes (and warns about each one),
+        # so read the names from the schema table instead
+        return set(connection.execute(
+            db.text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+            {"table": table_name},
+        ).scalars())
+    return {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+def upgrade_schema():
+    # db.create_all() only creates missing tables. Nullable columns and indexes
+    # added to existing models later are created in place.
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            if table.name in CACHE_TABLES and any(
+                not column.nullable and column.name not in existing for column in table.columns
+            ):
+                # A cache whose key gained a column is rebuilt rather than migrated
+                table.drop(connection)
+                table.create(connection)
+                continue
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            existing_indexes = _index_names(connection, inspector, table.name)
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    if index.name in INDEX_MIGRATIONS:
+                        INDEX_MIGRATIONS[index.name](connection)
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def dialect_insert(table):
+    # INSERT construct with ON CONFLICT support for the configured database
+    dialects = {"sqlite": sqlite, "postgresql": postgresql}
+    dialect = dialects.get(db.engine.dialect.name)
+    if dialect is None:
+        raise RuntimeError(f"Upserts are not supported on {db.engine.dialect.name}")
+    return dialect.insert(table)
+
 class Recipient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "email": self.email,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
 
     def __repr__(self):
         return f'<Recipient {self.email}>'
 
+# Case-insensitive prefix search on recipient names
+db.Index('ix_recipient_name_lower', db.func.lower(Recipient.name))
+# Emails are stored lowercased; this keeps a legacy mixed-case address from
+# ever existing next to its lowercased form (see merge_case_duplicate_recipients)
+db.Index('ux_recipient_email_lower', db.func.lower(Recipient.email), unique=True)
+
+
+def _merge_recipient(connection, duplicate, keeper):
+    params = {"duplicate": duplicate, "keeper": keeper}
+    for statement in (
+        "UPDATE segment_membership SET recipient_id = :keeper WHERE recipient_id = :duplicate "
+        "AND segment_id NOT IN (SELECT segment_id FROM segment_membership WHERE recipient_id = :keeper)",
+        "DELETE FROM segment_membership WHERE recipient_id = :duplicate",
+        # Where both are in a campaign's ledger, a message that already went to
+        # the duplicate counts for the keeper, so the person isn't mailed again
+        "UPDATE campaign_delivery SET (status, attempts, provider_message_id, provider_schedule_id, last_error) = ("
+        "SELECT d.status, d.attempts, d.provider_message_id, d.provider_schedule_id, d.last_error "
+        "FROM campaign_delivery d WHERE d.recipient_id = :duplicate AND d.campaign_id = campaign_delivery.campaign_id) "
+        "WHERE recipient_id = :keeper AND status IN ('pending', 'failed') AND campaign_id IN ("
+        "SELECT campaign_id FROM campaign_delivery WHERE recipient_id = :duplicate AND status NOT IN ('pending', 'failed'))",
+        "UPDATE campaign_delivery SET recipient_id = :keeper WHERE recipient_id = :duplicate "
+        "AND campaign_id NOT IN (SELECT campaign_id FROM campaign_delivery WHERE recipient_id = :keeper)",
+        "DELETE FROM campaign_delivery WHERE recipient_id = :duplicate",
+        "DELETE FROM recipient WHERE id = :duplicate",
+    ):
+        connection.execute(db.text(statement), params)
+
+
+def merge_case_duplicate_recipients(connection):
+    # Recipients added before emails were lowercased can differ from newer
+    # rows only in case, and ON CONFLICT(email) treats them as different
+    # people. Each group is merged into its oldest row, with its segment
+    # memberships and campaign deliveries, then every email is lowercased.
+    # Runs once, when upgrade_schema() creates ux_recipient_email_lower.
+    rows = connection.execute(db.text(
+        "SELECT lower(email), id FROM recipient WHERE lower(email) IN ("
+        "SELECT lower(email) FROM recipient GROUP BY lower(email) HAVING count(*) > 1) ORDER BY id"
+    )).all()
+    keepers = {}
+    for email, recipient_id in rows:
+        keeper = keepers.setdefault(email, recipient_id)
+        if keeper != recipient_id:
+            _merge_recipient(connection, recipient_id, keeper)
+    connection.execute(db.text("UPDATE recipient SET email = lower(email) WHERE email != lower(email)"))
+
 class Campaign(db.Model):
+    __table_args__ = (
+        db.Index('ix_campaign_status_scheduled_at', 'status', 'scheduled_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     subject = db.Column(db.String(200), nullable=False)
     body = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     scheduled_at = db.Column(db.DateTime)
-    status = db.Column(db.String(20), default='draft')  # draft, scheduled, sent
+    status = db.Column(db.String(20), default='draft')  # draft, generating, scheduled, recurring, staging, staged, partial, sent, done_with_failures
+    grant_id = db.Column(db.String(255))  # Nylas grant the campaign is sent from
+    segment_id = db.Column(db.Integer, db.ForeignKey('segment.id'))  # audience; all recipients when unset
+    delivery_window = db.Column(db.Integer)  # seconds; when set, sends are pre-staged with Nylas send_at
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "subject": self.subject,
+            "status": self.status,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "scheduled_at": self.scheduled_at.isoformat() if self.scheduled_at else None,
+            "segment_id": self.segment_id,
+            "delivery_window": self.delivery_window,
+        }
+
+    def __repr__(self):
+        return f'<Campaign {self.name}>'
+
+class Segment(db.Model):
+    # A named audience. 'list' segments are explicit memberships; 'rule'
+    # segments are evaluated against the recipient table whenever they are used.
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    kind = db.Column(db.String(10), nullable=False, default='list')  # list, rule
+    rule_json = db.Column(db.Text)  # {"domains": [...], "created_after": iso, "created_before": iso}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def rule(self):
+        return json.loads(self.rule_json) if self.rule_json else {}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "kind": self.kind,
+            "rule": self.rule,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Segment {self.name}>'
+
+class SegmentMembership(db.Model):
+    # The primary key serves lookups by segment; the recipient index serves
+    # "which segments is this recipient in" and cleanup on delete.
+    segment_id = db.Column(db.Integer, db.ForeignKey('segment.id'), primary_key=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('recipient.id'), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f'<SegmentMembership {self.segment_id}:{self.recipient_id}>'
+
+class CampaignDelivery(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'recipient_id', name='uq_delivery_campaign_recipient'),
+        db.Index('ix_delivery_campaign_status', 'campaign_id', 'status', 'id'),
+        # Undelivered rows of a campaign in id order, so iter_pending() needs no
+        # sort. Queries must repeat the condition with literal values (see
+        # ledger.undelivered) for SQLite to use the index.
+        db.Index('ix_delivery_undelivered', 'campaign_id', 'id',
+                 sqlite_where=db.text("status IN ('pending', 'failed')"),
+                 postgresql_where=db.text("status IN ('pending', 'failed')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('recipient.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, staged, failed, suppressed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    provider_message_id = db.Column(db.String(255))
+    provider_schedule_id = db.Column(db.String(255))  # set for messages staged with send_at
+    last_error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CampaignDelivery {self.campaign_id}:{self.recipient_id} {self.status}>'
+
+
+class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_status_created', 'status', 'created_at'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    params = db.Column(db.Text)  # JSON
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    message = db.Column(db.String(255))
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "total": self.total,
+            "message": self.message,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.kind} {self.id} {self.status}>'
+
+
+class EmailCategory(db.Model):
+    # Nylas message ids are only unique within a grant
+    __table_args__ = (
+        db.UniqueConstraint('grant_id', 'message_id', 'version', name='uq_category_grant_message_version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    grant_id = db.Column(db.String(255), nullable=False)
+    message_id = db.Column(db.String(255), nullable=False)
+    version = db.Column(db.String(100), nullable=False)  # model and prompt version
+    category = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
-        return f'<Campaign {self.name}>'
\ No newline at end of file
+        return f'<EmailCategory {self.message_id} {self.category}>'
+
+
+class LLMCacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of model, messages and params
+    model = db.Column(db.String(100), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    last_accessed = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<LLMCacheEntry {self.key[:12]} {self.model}>'
+
+
+class CachedMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_cached_message_grant_date', 'grant_id', 'date'),
+    )
+
+    # Nylas message ids are only unique within a grant
+    grant_id = db.Column(db.String(255), primary_key=True)
+    id = db.Column(db.String(255), primary_key=True)
+    thread_id = db.Column(db.String(255))
+    subject = db.Column(db.Text)
+    snippet = db.Column(db.Text)
+    from_json = db.Column(db.Text)
+    to_json = db.Column(db.Text)
+    body = db.Column(db.Text)
+    body_text = db.Column(db.Text)  # body cleaned for LLM prompts; computed on first use
+    date = db.Column(db.Integer)  # unix timestamp, as returned by Nylas
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def _participants(value):
+        return [SimpleNamespace(**participant) for participant in json.loads(value or "[]")]
+
+    @property
+    def from_(self):
+        return self._participants(self.from_json)
+
+    @property
+    def to(self):
+        return self._participants(self.to_json)
+
+    def __repr__(self):
+        return f'<CachedMessage {self.id}>'
+
+
+class MessageSyncState(db.Model):
+    grant_id = db.Column(db.String(255), primary_key=True)
+    latest_date = db.Column(db.Integer)  # newest message date seen so far
+    synced_at = db.Column(db.DateTime)  # None forces a synchronous sync
+
+    def __repr__(self):
+        return f'<MessageSyncState {self.grant_id}>'
+
+
+class CampaignVariant(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'segment', name='uq_variant_campaign_segment'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False)
+    segment = db.Column(db.String(255), nullable=False)  # e.g. the recipients' email domain
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CampaignVariant {self.campaign_id}:{self.segment}>'
+
+
+class SchedulerLease(db.Model):
+    # Held by the one process allowed to fire scheduled jobs
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} {self.owner}>'
+
+
+class SessionRecord(db.Model):
+    # Server-side Flask session: msgpack-encoded data keyed by the cookie's
+    # session id. Expired rows are ignored on read and swept in batches.
+    __tablename__ = 'session_record'
+    id = db.Column(db.String(255), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<SessionRecord {self.id}>'
+
+
+class Suppression(db.Model):
+    # Addresses that must never be mailed (bounced, unsubscribed, complained)
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    reason = db.Column(db.String(20), nullable=False, default='manual')  # bounce, unsubscribe, complaint, manual
+    source = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Suppression {self.email}>'
+
+
+# Tables upgrade_schema() may drop and recreate: their rows are recomputed on demand
+CACHE_TABLES = {'email_category'}
+
+# Data migrations upgrade_schema() runs on an existing table before creating
+# the index that depends on them
+INDEX_MIGRATIONS = {
+    'ux_recipient_email_lower': merge_case_duplicate_recipients,
+}
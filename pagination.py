@@ -0,0 +1,57 @@
+from sqlalchemy import func, tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def page_size(value):
+    try:
+        return max(1, min(MAX_PAGE_SIZE, int(value)))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+
+def _page(rows, limit, key):
+    # Splits the extra row fetched past limit off into the next page's cursor
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = getattr(rows[-1], key)
+    return rows, next_cursor
+
+
+def keyset_page(query, key_column, after=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+    # Returns (rows, next_cursor). Each page starts where the previous one ended
+    # on key_column, so the cost of a page doesn't grow with its position.
+    if after is not None:
+        query = query.filter(key_column < after if descending else key_column > after)
+    rows = query.order_by(key_column.desc() if descending else key_column).limit(limit + 1).all()
+    return _page(rows, limit, key_column.key)
+
+
+def search_recipients(query, model, q, after=None, limit=DEFAULT_PAGE_SIZE):
+    # Returns (rows, next_cursor) like keyset_page(), filtered to a
+    # case-insensitive prefix of the name or, for queries containing "@", of
+    # the (lowercased) email. Matches are ordered by that expression and id,
+    # which is the order of its index (ix_recipient_name_lower, or the email
+    # index), so a page reads about limit rows however many match.
+    q = (q or "").strip()
+    if not q:
+        return keyset_page(query, model.id, after=after, limit=limit)
+    expression = model.email if "@" in q else func.lower(model.name)
+    # A range instead of LIKE, which SQLite only optimizes for case-sensitive collations
+    start, end = q.lower(), q.lower() + "\uffff"
+    if after is not None:
+        cursor = query.session.query(expression).filter(model.id == after).scalar()
+        if cursor is not None and cursor >= start:
+            # The range starts at the previous page's last row rather than at
+            # the prefix: with two lower bounds SQLite may seek to the wrong one
+            start = cursor
+            query = query.filter(tuple_(expression, model.id) > tuple_(cursor, after))
+    rows = (
+        query.filter(expression >= start, expression < end)
+        .order_by(expression, model.id)
+        .limit(limit + 1)
+        .all()
+    )
+    return _page(rows, limit, model.id.key)
@@ -0,0 +1,140 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from jinja2 import TemplateError
+from jinja2.sandbox import SandboxedEnvironment
+
+from models import db, Recipient, CampaignVariant
+
+logger = logging.getLogger(__name__)
+
+# Merge fields available in campaign subjects and bodies, e.g. "Hi {{first_name}},"
+TEMPLATE_VARIABLES = ("name", "first_name", "email", "domain")
+MERGE_FIELD_INSTRUCTIONS = (
+    "Personalize the email with these merge fields, written exactly like this: "
+    "{{first_name}} for the recipient's first name and {{name}} for their full name. "
+    "Do not use any other placeholders."
+)
+
+# Bodies are sent as HTML, so values are escaped there; subjects are plain text.
+_body_env = SandboxedEnvironment(autoescape=True)
+_subject_env = SandboxedEnvironment(autoescape=False)
+
+
+class _Verbatim:
+    # Stand-in for text that is not a valid template: sent as written
+    def __init__(self, text):
+        self.text = text
+
+    def render(self, context):
+        return self.text
+
+
+@lru_cache(maxsize=256)
+def compile_template(text, html=True):
+    try:
+        return (_body_env if html else _subject_env).from_string(text or "")
+    except TemplateError as e:
+        logger.warning("Not a valid template, sending as is: %s", e)
+        return _Verbatim(text or "")
+
+
+def email_domain(email):
+    return email.rsplit("@", 1)[-1].lower()
+
+
+# Ways to split recipients into segments for AI-personalized variants
+SEGMENTERS = {
+    "domain": email_domain,
+}
+
+
+def recipient_context(name, email):
+    name = (name or "").strip()
+    return {
+        "name": name,
+        "first_name": name.split()[0] if name else "",
+        "email": email,
+        "domain": email_domain(email),
+    }
+
+
+class CampaignRenderer:
+    # Renders a campaign for one recipient at a time. Templates are compiled
+    # once; segment variants, if any, replace the body for their segment.
+    def __init__(self, subject, body, variants=None, segmenter="domain"):
+        self.subject = compile_template(subject, html=False)
+        self.body = compile_template(body)
+        self.variants = {segment: compile_template(text) for segment, text in (variants or {}).items()}
+        self.segment_of = SEGMENTERS[segmenter]
+
+    @classmethod
+    def for_campaign(cls, campaign):
+        variants = dict(db.session.execute(
+            db.select(CampaignVariant.segment, CampaignVariant.body)
+            .where(CampaignVariant.campaign_id == campaign.id)
+        ).all())
+        return cls(campaign.subject, campaign.body, variants)
+
+    def render(self, name, email):
+        context = recipient_context(name, email)
+        body = self.variants.get(self.segment_of(email), self.body) if self.variants else self.body
+        try:
+            return self.subject.render(context), body.render(context)
+        except TemplateError as e:
+            logger.warning("Could not render campaign for %s: %s", email, e)
+            return self.subject.render({}), body.render({})
+
+
+def iter_recipients(chunk_size=1000, audience=None):
+    # (name, email) for every recipient (or those matching the audience
+    # clause), read in keyset-paginated chunks so callers can commit between
+    # chunks without invalidating a cursor
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Recipient.id, Recipient.name, Recipient.email)
+            .where(Recipient.id > last_id, audience if audience is not None else db.true())
+            .order_by(Recipient.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        for _, name, email in rows:
+            yield name, email
+        last_id = rows[-1][0]
+
+
+def largest_segments(segmenter="domain", limit=50, audience=None):
+    segment_of = SEGMENTERS[segmenter]
+    counts = Counter(segment_of(email) for _, email in iter_recipients(audience=audience))
+    return [segment for segment, _ in counts.most_common(limit)]
+
+
+def generate_segment_variants(llm, prompt, base_body, segments, workers=4):
+    # One completion per segment, run concurrently. Returns {segment: body};
+    # segments whose generation fails fall back to the base body at send time.
+    def generate(segment):
+        try:
+            return segment, llm.complete(
+                "personalize_segment",
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are an email marketing assistant. " + MERGE_FIELD_INSTRUCTIONS},
+                    {"role": "user", "content": (
+                        f"This campaign email was written for: {prompt}\n\n{base_body}\n\n"
+                        f"Rewrite it for recipients whose email address is at {segment}. "
+                        "Tailor the tone and examples to that audience."
+                    )}
+                ],
+                max_tokens=300,
+                temperature=0.7
+            )
+        except Exception as e:
+            logger.error("Error generating variant for segment %s: %s", segment, e)
+            return segment, None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="personalize") as executor:
+        return {segment: body for segment, body in executor.map(generate, segments) if body}
@@ -0,0 +1,292 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import openai
+import requests
+import urllib3
+from flask import has_request_context
+from nylas.handler import http_client as nylas_http_client
+from nylas.models.errors import AbstractNylasApiError, NylasSdkTimeoutError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Statuses that mean the request was not acted on, so it can be resent even
+# when repeating it would otherwise duplicate its effect
+RESENDABLE_STATUS_CODES = {408, 429}
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    NylasSdkTimeoutError,
+    openai.APIConnectionError,  # includes APITimeoutError
+)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open; retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def error_status_code(error):
+    return getattr(error, "status_code", None)
+
+
+def _keep_nylas_error_headers():
+    # Older nylas SDKs (6.3, for one) raise NylasApiError without the
+    # response headers, so a 429's Retry-After was lost. Wrap the SDK's
+    # response check to copy them onto the error.
+    validate = nylas_http_client._validate_response
+    if getattr(validate, "keeps_headers", False):
+        return
+
+    def validate_response(response):
+        try:
+            return validate(response)
+        except AbstractNylasApiError as e:
+            if getattr(e, "headers", None) is None:
+                e.headers = response.headers
+            raise
+
+    validate_response.keeps_headers = True
+    nylas_http_client._validate_response = validate_response
+
+
+_keep_nylas_error_headers()
+
+
+def nylas_overrides(timeout, overrides=None):
+    # RequestOverrides for a Nylas call that may take at most timeout seconds
+    if timeout is None:
+        return overrides
+    return dict(overrides or {}, timeout=timeout)
+
+
+def _error_headers(error):
+    # Nylas errors carry headers directly (see _keep_nylas_error_headers);
+    # OpenAI errors on their response
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    return headers if hasattr(headers, "get") else {}
+
+
+def is_retryable(error):
+    if isinstance(error, (CircuitOpenError,) + TRANSPORT_ERRORS):
+        return True
+    return error_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def is_connect_failure(error):
+    # True when the request never reached the server: the connection was
+    # refused, the host didn't resolve or connecting timed out. Read timeouts
+    # and dropped connections don't count, as the request had been sent.
+    while error is not None:
+        if isinstance(error, (requests.exceptions.ConnectTimeout, urllib3.exceptions.NewConnectionError,
+                              ConnectionRefusedError)):
+            return True
+        if isinstance(error, urllib3.exceptions.MaxRetryError):
+            error = error.reason
+        elif isinstance(error, requests.exceptions.ConnectionError) and error.args \
+                and isinstance(error.args[0], BaseException):
+            error = error.args[0]
+        else:
+            error = error.__cause__  # e.g. NylasSdkTimeoutError wraps the requests timeout
+    return False
+
+
+def is_safe_to_resend(error):
+    # is_retryable() for requests that must not run twice, such as sending a
+    # message. A timeout or 5xx may come after the server acted on the request,
+    # so only errors showing it didn't are retried.
+    if isinstance(error, CircuitOpenError) or is_connect_failure(error):
+        return True
+    return error_status_code(error) in RESENDABLE_STATUS_CODES
+
+
+def outcome_unknown(error):
+    # A retryable error after which the request may still have been processed
+    return is_retryable(error) and not is_safe_to_resend(error)
+
+
+def is_upstream_failure(error):
+    # Failures that say the upstream is unhealthy, as opposed to a bad request
+    # or a rate limit. Only these count towards opening a circuit.
+    if isinstance(error, TRANSPORT_ERRORS):
+        return True
+    status_code = error_status_code(error)
+    return status_code is not None and status_code >= 500
+
+
+def retry_after_seconds(error):
+    if isinstance(error, CircuitOpenError):
+        return error.retry_after
+    headers = _error_headers(error)
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except (TypeError, ValueError):
+            pass
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # "Full jitter": uniform over [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=30, deadline=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline  # seconds for all attempts and waits together
+
+
+# Request handlers give up quickly so a slow upstream doesn't tie up the
+# worker; jobs and scheduled sends can afford to wait it out. Completions take
+# seconds to generate, so request threads allow them longer.
+INTERACTIVE = RetryPolicy(max_attempts=3, base_delay=0.25, max_delay=2, deadline=5)
+INTERACTIVE_LLM = RetryPolicy(max_attempts=2, base_delay=0.25, max_delay=2, deadline=30)
+BACKGROUND = RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=30, deadline=120)
+MIN_ATTEMPT_TIMEOUT = 0.5  # seconds, for an attempt that starts just before the deadline
+
+
+def default_policy(interactive=INTERACTIVE):
+    return interactive if has_request_context() else BACKGROUND
+
+
+def attempt_timeout(policy, started):
+    # Seconds the next attempt may take: what is left of the deadline, or None
+    # (the client's own default) without one
+    if policy.deadline is None:
+        return None
+    return max(MIN_ATTEMPT_TIMEOUT, policy.deadline - (time.monotonic() - started))
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive upstream failures and rejects
+    # calls for reset_timeout seconds. Then one trial call is let through:
+    # success closes the circuit, failure opens it again.
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(self.name, remaining)
+            if self.trial_in_flight:
+                raise CircuitOpenError(self.name, min(1.0, self.reset_timeout))
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("Circuit %s closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self, error):
+        with self.lock:
+            was_trial = self.trial_in_flight
+            self.trial_in_flight = False
+            if not is_upstream_failure(error):
+                return
+            self.failures += 1
+            if was_trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                metrics.CIRCUIT_OPENED.inc(circuit=self.name)
+                logger.warning("Circuit %s opened after %s failures: %s", self.name, self.failures, error)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=5, reset_timeout=30):
+    # One breaker per upstream endpoint, shared across threads
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return breaker
+
+
+def _next_delay(error, attempt, policy, started, retryable=is_retryable):
+    # Seconds to wait before the next attempt, or None to give up
+    if not retryable(error) or attempt >= policy.max_attempts:
+        return None
+    delay = retry_after_seconds(error)
+    if delay is None:
+        delay = backoff_delay(attempt, policy.base_delay, policy.max_delay)
+    if policy.deadline is not None and time.monotonic() - started + delay > policy.deadline:
+        return None
+    return delay
+
+
+def call(func, policy=None, breaker=None, on_retry=None, retryable=is_retryable):
+    # Calls func(timeout) until it succeeds, the error isn't retryable, or the
+    # policy's attempts or deadline run out. timeout is what is left of the
+    # deadline (see attempt_timeout) and func passes it on to its client, so a
+    # single slow attempt can't outlast the deadline either. Waits honour
+    # Retry-After (and an open circuit's remaining time), otherwise back off
+    # with full jitter. on_retry(error, delay) runs before each wait. Pass
+    # retryable=is_safe_to_resend for calls that must not be repeated.
+    policy = policy or default_policy()
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if breaker is not None:
+                breaker.before_call()
+            result = func(attempt_timeout(policy, started))
+        except Exception as e:
+            if breaker is not None and not isinstance(e, CircuitOpenError):
+                breaker.record_failure(e)
+            delay = _next_delay(e, attempt, policy, started, retryable)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(e, delay)
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
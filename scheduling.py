@@ -0,0 +1,133 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import update, or_
+
+from models import db, SchedulerLease, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# Persistent jobs reference their target by import path. Targets are looked up
+# through this module so the path stays the same however app.py was started.
+_targets = {}
+
+
+def job_target(name):
+    def decorator(func):
+        _targets[name] = func
+        return func
+    return decorator
+
+
+def run_job(name, *args, **kwargs):
+    return _targets[name](*args, **kwargs)
+
+
+def create_scheduler(misfire_grace_time=3600):
+    # Must be called inside an app context: jobs are stored in the app's database
+    return BackgroundScheduler(
+        jobstores={"default": SQLAlchemyJobStore(engine=db.engine)},
+        job_defaults={
+            "coalesce": True,  # a job that missed several runs fires once
+            "max_instances": 1,
+            "misfire_grace_time": misfire_grace_time,
+        },
+        timezone="UTC",  # scheduled_at values are stored as naive UTC
+    )
+
+
+class LeaderLease:
+    # Row-level lease in the scheduler_lease table. Only the holder runs
+    # scheduled jobs; it renews the lease well before it expires, and another
+    # process takes over once it has lapsed.
+    def __init__(self, app, name="scheduler", ttl=30):
+        self.app = app
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def try_acquire(self):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        with self.app.app_context():
+            renewed = db.session.execute(
+                update(SchedulerLease)
+                .where(
+                    SchedulerLease.name == self.name,
+                    or_(SchedulerLease.owner == self.owner, SchedulerLease.expires_at < now),
+                )
+                .values(owner=self.owner, expires_at=expires_at)
+            ).rowcount
+            if not renewed:
+                renewed = db.session.execute(
+                    dialect_insert(SchedulerLease.__table__)
+                    .values(name=self.name, owner=self.owner, expires_at=expires_at)
+                    .on_conflict_do_nothing(index_elements=["name"])
+                ).rowcount
+            db.session.commit()
+        return renewed == 1
+
+    def release(self):
+        with self.app.app_context():
+            db.session.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name, SchedulerLease.owner == self.owner)
+                .values(expires_at=datetime.utcnow())
+            )
+            db.session.commit()
+
+
+class SchedulerSupervisor:
+    # Every process starts the scheduler paused, so any of them can add jobs to
+    # the shared job store. Only the lease holder resumes it and fires jobs.
+    # The leader also wakes the scheduler on every renewal so it notices jobs
+    # that other processes added to the store.
+    def __init__(self, scheduler, lease, on_leadership=None):
+        self.scheduler = scheduler
+        self.lease = lease
+        self.on_leadership = on_leadership
+        self.is_leader = False
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.scheduler.start(paused=True)
+        thread = threading.Thread(target=self._run, name="scheduler-leader", daemon=True)
+        thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_leader:
+            self.is_leader = False
+            self.lease.release()
+
+    def _run(self):
+        interval = max(1, self.lease.ttl / 3)
+        while not self.stopped.is_set():
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error("Scheduler leadership check failed: %s", e)
+            self.stopped.wait(interval)
+
+    def _tick(self):
+        leader = self.lease.try_acquire()
+        if leader and not self.is_leader:
+            logger.info("Acquired scheduler lease as %s", self.lease.owner)
+            self.is_leader = True
+            if self.on_leadership:
+                self.on_leadership()
+            self.scheduler.resume()
+        elif not leader and self.is_leader:
+            logger.warning("Lost scheduler lease; pausing scheduled jobs")
+            self.is_leader = False
+            self.scheduler.pause()
+        if self.is_leader:
+            self.scheduler.wakeup()
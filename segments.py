@@ -0,0 +1,102 @@
+import json
+import re
+from datetime import datetime
+
+from sqlalchemy import select, and_, or_, true
+
+from models import db, Recipient, Segment, SegmentMembership, dialect_insert
+
+DOMAIN_RE = re.compile(r"^[a-z0-9](?:[a-z0-9.-]*[a-z0-9])?$")
+
+
+def build_rule(domains="", created_after=None, created_before=None):
+    # Validated rule for a dynamic segment, from form-style input.
+    # Raises ValueError on a bad domain or date.
+    rule = {}
+    domains = [d.strip().lower().lstrip("@") for d in re.split(r"[,\s]+", domains or "") if d.strip()]
+    for domain in domains:
+        if not DOMAIN_RE.match(domain):
+            raise ValueError(f"Invalid domain: {domain}")
+    if domains:
+        rule["domains"] = domains
+    for key, value in (("created_after", created_after), ("created_before", created_before)):
+        if value:
+            rule[key] = datetime.fromisoformat(value).isoformat()
+    if not rule:
+        raise ValueError("A rule needs at least one domain or date")
+    return rule
+
+
+def rule_conditions(rule):
+    conditions = []
+    if rule.get("domains"):
+        # Emails are stored normalized to lowercase (see importer.normalize_email)
+        conditions.append(or_(*[Recipient.email.like(f"%@{domain}") for domain in rule["domains"]]))
+    if rule.get("created_after"):
+        conditions.append(Recipient.created_at >= datetime.fromisoformat(rule["created_after"]))
+    if rule.get("created_before"):
+        conditions.append(Recipient.created_at < datetime.fromisoformat(rule["created_before"]))
+    return conditions
+
+
+def audience_condition(segment):
+    # WHERE clause on Recipient selecting the segment's members; everyone when
+    # there is no segment
+    if segment is None:
+        return true()
+    if segment.kind == "list":
+        return Recipient.id.in_(
+            select(SegmentMembership.recipient_id).where(SegmentMembership.segment_id == segment.id)
+        )
+    return and_(*rule_conditions(segment.rule))
+
+
+def iter_audience_ids(segment, chunk_size=1000):
+    # Recipient ids in the audience, as lists of up to chunk_size ids.
+    # List segments page through the membership primary key; rules and the
+    # full audience page through recipient ids.
+    if segment is not None and segment.kind == "list":
+        column = SegmentMembership.recipient_id
+        query = select(column).where(SegmentMembership.segment_id == segment.id)
+    else:
+        column = Recipient.id
+        query = select(column).where(audience_condition(segment))
+    last_id = 0
+    while True:
+        ids = db.session.execute(query.where(column > last_id).order_by(column).limit(chunk_size)).scalars().all()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def audience_size(segment):
+    return db.session.execute(
+        select(db.func.count(Recipient.id)).where(audience_condition(segment))
+    ).scalar()
+
+
+def create_segment(name, kind="list", rule=None):
+    segment = Segment(name=name, kind=kind, rule_json=json.dumps(rule) if rule else None)
+    db.session.add(segment)
+    db.session.commit()
+    return segment
+
+
+def add_members(segment_id, emails, chunk_size=500):
+    # Adds the recipients with these addresses to a list segment; unknown
+    # addresses are ignored. Returns the number of emails matched.
+    emails = list(emails)
+    matched = 0
+    for start in range(0, len(emails), chunk_size):
+        ids = db.session.execute(
+            select(Recipient.id).where(Recipient.email.in_(emails[start:start + chunk_size]))
+        ).scalars().all()
+        if ids:
+            db.session.execute(
+                dialect_insert(SegmentMembership.__table__).on_conflict_do_nothing(),
+                [{"segment_id": segment_id, "recipient_id": recipient_id} for recipient_id in ids],
+            )
+        matched += len(ids)
+    db.session.commit()
+    return matched
@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import metrics
+import resilience
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # Thread-safe token bucket. The refill rate adapts: it is halved when the
+    # provider pushes back (429/5xx) and creeps back up to max_rate on success.
+    def __init__(self, rate, capacity=None, min_rate=0.5):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def throttle(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def recover(self, step=0.1):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + step * self.max_rate)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(grant_id, rate, capacity=None):
+    # One bucket per grant so concurrent campaigns on the same account share
+    # the provider's rate limit instead of each assuming the full budget.
+    with _buckets_lock:
+        bucket = _buckets.get(grant_id)
+        if bucket is None or bucket.max_rate != float(rate):
+            bucket = TokenBucket(rate, capacity)
+            _buckets[grant_id] = bucket
+        return bucket
+
+
+class SendStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def incr(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return (self.sent / elapsed) if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "messages_per_second": round(self.throughput, 2),
+        }
+
+
+def send_message(nylas_client, grant_id, request_body, overrides=None):
+    # POST /messages/send, returning the raw "data" of the response. The SDK's
+    # Message model drops schedule_id, which staged campaigns need to cancel or
+    # reschedule their messages. Campaign messages carry no attachments, so the
+    # SDK's multipart handling is not needed.
+    response = nylas_client.http_client._execute(
+        "POST", f"/v3/grants/{grant_id}/messages/send", request_body=request_body, overrides=overrides
+    )
+    if isinstance(response, tuple):
+        # Newer SDKs return (json, headers)
+        response = response[0]
+    return response.get("data") or {}
+
+
+class SendResult:
+    # response is the raw message data returned by send_message
+    def __init__(self, key, response=None, error=None, attempts=1):
+        self.key = key
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def outcome_unknown(self):
+        # Failed with an error after which the message may have gone out anyway
+        return self.error is not None and resilience.outcome_unknown(self.error)
+
+    @property
+    def message_id(self):
+        return (self.response or {}).get("id")
+
+    @property
+    def schedule_id(self):
+        # Only present when the message was sent with send_at
+        return (self.response or {}).get("schedule_id")
+
+
+def spread_send_times(start, window, count):
+    # Yields count unix timestamps evenly spaced over [start, start + window),
+    # so Nylas releases a staged campaign gradually instead of all at once.
+    first = int(start.replace(tzinfo=timezone.utc).timestamp())
+    for index in range(count):
+        yield first + window * index // max(1, count)
+
+
+class CampaignDispatcher:
+    # Fans message sends out over a bounded thread pool. Results are handed back
+    # to the calling thread through on_result, so callers can do their own
+    # bookkeeping (database writes etc.) without sharing sessions across threads.
+    def __init__(self, nylas_client, workers=8, rate=10, max_retries=4, backoff_base=0.5, backoff_cap=30):
+        self.nylas = nylas_client
+        self.workers = max(1, int(workers))
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # While Nylas is down, sends wait for the circuit to half-open instead
+        # of each burning through its attempts
+        self.breaker = resilience.get_breaker("nylas:messages.send")
+
+    def _send_one(self, grant_id, bucket, key, request_body, stats):
+        attempts = 0
+        policy = resilience.RetryPolicy(self.max_retries, self.backoff_base, self.backoff_cap)
+
+        def send(timeout):
+            nonlocal attempts
+            attempts += 1
+            bucket.acquire()
+            with metrics.nylas_call("messages.send"):
+                return send_message(self.nylas, grant_id, request_body, resilience.nylas_overrides(timeout))
+
+        def on_retry(error, delay):
+            if resilience.error_status_code(error) is not None:
+                bucket.throttle()
+                stats.incr("throttled")
+            stats.incr("retries")
+            metrics.NYLAS_RETRIES.inc(operation="messages.send")
+
+        try:
+            # A send that timed out or got a 5xx may still have been delivered,
+            # so only failures that prove it wasn't are retried
+            response = resilience.call(send, policy, self.breaker, on_retry, retryable=resilience.is_safe_to_resend)
+        except Exception as e:
+            return SendResult(key, error=e, attempts=attempts)
+        bucket.recover()
+        return SendResult(key, response=response, attempts=attempts)
+
+    def send_all(self, grant_id, messages, on_result=None):
+        # messages is an iterable of (key, request_body) pairs. It is consumed
+        # lazily, with at most 2 * workers sends in flight at any time.
+        stats = SendStats()
+        bucket = get_rate_limiter(grant_id, self.rate)
+        max_in_flight = self.workers * 2
+        pending = set()
+        messages = iter(messages)
+        exhausted = False
+
+        def drain(futures):
+            for future in futures:
+                result = future.result()
+                if result.ok:
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
+                if on_result:
+                    on_result(result)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="campaign-send") as executor:
+            while pending or not exhausted:
+                while not exhausted and len(pending) < max_in_flight:
+                    try:
+                        key, request_body = next(messages)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(self._send_one, grant_id, bucket, key, request_body, stats))
+                if pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    drain(done)
+
+        stats.finished = time.monotonic()
+        logger.info("Dispatched %s messages for grant %s: %s", stats.sent + stats.failed, grant_id, stats.as_dict())
+        return stats
@@ -0,0 +1,97 @@
+import logging
+from datetime import datetime
+
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+from sqlalchemy import select, delete
+
+from models import db, SessionRecord, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+
+class StoredSession(ServerSideSession):
+    def __init__(self, initial=None, sid=None, permanent=None, stored=None, expires_at=None):
+        super().__init__(initial, sid, permanent)
+        # Encoded data and expiry as last written, to skip redundant writes
+        self.stored = stored
+        self.expires_at = expires_at
+
+
+class DatabaseSessionInterface(ServerSideSessionInterface):
+    # Flask-Session backend on the app database. Sessions live in the
+    # session_record table (msgpack, indexed expiry) and are read and written
+    # with their own connection, outside the request's db.session.
+    #
+    # A session is only written when its encoded data changed, or when less
+    # than refresh_fraction of its lifetime is left, so an active session
+    # slides forward without a write on every request.
+    session_class = StoredSession
+    ttl = True  # expiry is handled by sweep(), not Flask-Session's cleanup hooks
+
+    def __init__(self, app, refresh_fraction=0.5, **kwargs):
+        kwargs.setdefault("permanent", app.config.get("SESSION_PERMANENT", True))
+        super().__init__(app, **kwargs)
+        self.refresh_fraction = refresh_fraction
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if sid:
+            row = self._retrieve_session_data(self._get_store_id(sid))
+            if row is not None:
+                try:
+                    return self.session_class(
+                        self.serializer.decode(row.data), sid=sid, stored=row.data, expires_at=row.expires_at,
+                    )
+                except Exception as e:
+                    logger.warning("Discarding unreadable session: %s", e)
+        return self.session_class(sid=self._generate_sid(self.sid_length), permanent=self.permanent)
+
+    def should_set_storage(self, app, session):
+        if session.stored is None:
+            return True
+        if session.modified and self.serializer.encode(session) != session.stored:
+            return True
+        remaining = session.expires_at - datetime.utcnow()
+        return remaining < app.permanent_session_lifetime * self.refresh_fraction
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        data = self.serializer.encode(session)
+        expires_at = datetime.utcnow() + session_lifetime
+        stmt = dialect_insert(SessionRecord.__table__).values(id=store_id, data=data, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"], set_={"data": stmt.excluded.data, "expires_at": stmt.excluded.expires_at},
+        )
+        with db.engine.begin() as conn:
+            conn.execute(stmt)
+        session.stored = data
+        session.expires_at = expires_at
+
+    def _retrieve_session_data(self, store_id):
+        # The unexpired row (data, expires_at), or None. Unlike the base class
+        # this returns the encoded data, which open_session keeps along with
+        # the expiry to skip redundant writes.
+        with db.engine.connect() as conn:
+            return conn.execute(
+                select(SessionRecord.data, SessionRecord.expires_at)
+                .where(SessionRecord.id == store_id, SessionRecord.expires_at > datetime.utcnow())
+            ).first()
+
+    def _delete_session(self, store_id):
+        with db.engine.begin() as conn:
+            conn.execute(delete(SessionRecord).where(SessionRecord.id == store_id))
+
+    def sweep(self, batch_size=1000):
+        # Deletes expired sessions a batch at a time along the expiry index,
+        # so a large backlog never holds a long write lock. Returns the count.
+        deleted = 0
+        while True:
+            with db.engine.begin() as conn:
+                expired = (
+                    select(SessionRecord.id)
+                    .where(SessionRecord.expires_at <= datetime.utcnow())
+                    .limit(batch_size)
+                )
+                count = conn.execute(delete(SessionRecord).where(SessionRecord.id.in_(expired))).rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from itertools import islice
+
+from sqlalchemy import select
+
+from importer import normalize_email
+from models import db, Suppression, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+SUPPRESSION_REASONS = ("bounce", "unsubscribe", "complaint", "manual")
+
+
+def _key(email):
+    # Suppressions are stored normalized (see importer.normalize_email)
+    return (email or "").strip().lower()
+
+
+class BloomFilter:
+    # Fixed-size bloom filter over strings: no false negatives, false
+    # positives at about error_rate once capacity items have been added.
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SuppressionList:
+    # In-memory index of the suppression table, loaded at startup and updated
+    # incrementally: rows added by this process are indexed immediately, rows
+    # added by other processes are picked up (by id) every refresh_interval.
+    #
+    # Up to max_exact addresses are kept in a set. Beyond that only a bloom
+    # filter is kept, and the few addresses it flags are confirmed with one
+    # query per batch. Either way most lookups never touch the database.
+    def __init__(self, app=None, max_exact=1_000_000, refresh_interval=30, error_rate=0.001):
+        self.max_exact = max_exact
+        self.refresh_interval = refresh_interval
+        self.error_rate = error_rate
+        self.exact = set()
+        self.bloom = BloomFilter(1024, error_rate)
+        self.last_id = 0
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_exact = app.config.get("SUPPRESSION_MAX_EXACT", self.max_exact)
+        self.refresh_interval = app.config.get("SUPPRESSION_REFRESH_INTERVAL", self.refresh_interval)
+        app.extensions["suppression"] = self
+
+    def __len__(self):
+        return self.bloom.count
+
+    def load(self, chunk_size=10000):
+        # Full (re)build from the table, sized for its current contents
+        total = db.session.execute(select(db.func.count(Suppression.id))).scalar()
+        exact = set() if total <= self.max_exact else None
+        bloom = BloomFilter(max(1024, total * 2), self.error_rate)
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(Suppression.id, Suppression.email)
+                .where(Suppression.id > last_id)
+                .order_by(Suppression.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            for _, email in rows:
+                bloom.add(email)
+                if exact is not None:
+                    exact.add(email)
+            last_id = rows[-1][0]
+        with self.lock:
+            self.exact = exact
+            self.bloom = bloom
+            self.last_id = max(self.last_id, last_id)
+            self.refreshed_at = time.monotonic()
+        logger.info("Loaded %s suppressed addresses", total)
+
+    def refresh(self):
+        # Index rows added since the last load or refresh
+        rows = db.session.execute(
+            select(Suppression.id, Suppression.email)
+            .where(Suppression.id > self.last_id)
+            .order_by(Suppression.id)
+        ).all()
+        self._index(email for _, email in rows)
+        with self.lock:
+            if rows:
+                self.last_id = max(self.last_id, rows[-1][0])
+            self.refreshed_at = time.monotonic()
+
+    def _index(self, emails):
+        rebuild = False
+        with self.lock:
+            for email in emails:
+                self.bloom.add(email)
+                if self.exact is not None:
+                    self.exact.add(email)
+            if self.exact is not None and len(self.exact) > self.max_exact:
+                self.exact = None
+            rebuild = self.bloom.count > self.bloom.capacity
+        if rebuild:
+            # Past capacity the false positive rate climbs; resize
+            self.load()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+    def suppressed_among(self, emails):
+        # The subset of emails (normalized addresses) that are suppressed
+        self._maybe_refresh()
+        with self.lock:
+            exact, bloom = self.exact, self.bloom
+            if exact is not None:
+                return {email for email in emails if email in exact}
+            candidates = [email for email in emails if email in bloom]
+        if not candidates:
+            return set()
+        return set(db.session.execute(
+            select(Suppression.email).where(Suppression.email.in_(candidates))
+        ).scalars())
+
+    def partition(self, items, email_of, chunk_size=500):
+        # Yields (item, suppressed) for each item, checking a chunk at a time.
+        # Addresses are compared lowercased: recipients stored before import
+        # normalization existed can be mixed case.
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return
+            keys = [_key(email_of(item)) for item in chunk]
+            suppressed = self.suppressed_among(keys)
+            for item, key in zip(chunk, keys):
+                yield item, key in suppressed
+
+    def add(self, pairs, source=None, chunk_size=1000):
+        # pairs is an iterable of (email, reason). Addresses are normalized;
+        # invalid ones are counted and skipped. Returns (added, rejected).
+        added = rejected = 0
+        pairs = iter(pairs)
+        while True:
+            chunk = list(islice(pairs, chunk_size))
+            if not chunk:
+                break
+            rows = {}
+            for email, reason in chunk:
+                email = normalize_email(email)
+                if not email:
+                    rejected += 1
+                    continue
+                reason = (reason or "").strip().lower()
+                rows[email] = reason if reason in SUPPRESSION_REASONS else "manual"
+            if rows:
+                added += db.session.execute(
+                    dialect_insert(Suppression.__table__).on_conflict_do_nothing(index_elements=["email"]),
+                    [{"email": email, "reason": reason, "source": source} for email, reason in rows.items()],
+                ).rowcount
+                db.session.commit()
+                self._index(rows)
+        return added, rejected
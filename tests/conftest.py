@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fakes import Faults, FakeNylas, FakeOpenAI  # noqa: E402
+
+GRANT_ID = "test-grant"
+
+
+@pytest.fixture(scope="session")
+def fake_servers():
+    faults = Faults()
+    nylas_server = FakeNylas(faults, messages=5, contacts=0).start()
+    openai_server = FakeOpenAI(faults).start()
+    yield nylas_server, openai_server
+    nylas_server.stop()
+    openai_server.stop()
+
+
+@pytest.fixture(scope="session")
+def app_module(fake_servers, tmp_path_factory):
+    nylas_server, openai_server = fake_servers
+    # app.py configures itself from the environment at import time
+    with pytest.MonkeyPatch.context() as patch:
+        for key, value in {
+            "NYLAS_API_URI": nylas_server.url,
+            "NYLAS_API_KEY": "test",
+            "OPENAI_BASE_URL": f"{openai_server.url}/v1",
+            "OPENAI_API_KEY": "test",
+            "DATABASE_URL": f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}",
+            "CAMPAIGN_SEND_RATE": "1000000",
+        }.items():
+            patch.setenv(key, value)
+        import app
+
+    app.app.config["TESTING"] = True
+    yield app
+    app.scheduler_supervisor.stop()
+    with app.app.app_context():
+        app.db.engine.dispose()
+
+
+@pytest.fixture
+def client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session["grant_id"] = GRANT_ID
+    return client
+
+
+def wait_for_job(client, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").get_json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.02)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from conftest import wait_for_job
+
+
+def create_campaign(app_module, name, recipients, **fields):
+    from models import db, Recipient, Campaign
+    from segments import create_segment, add_members
+
+    emails = [f"{name}-{i}@example.com" for i in range(recipients)]
+    with app_module.app.app_context():
+        db.session.add_all(Recipient(name=f"Recipient {i}", email=email) for i, email in enumerate(emails))
+        db.session.commit()
+        segment = create_segment(name)
+        add_members(segment.id, emails)
+        campaign = Campaign(name=name, subject="Hello", body="<p>Hi {{first_name}}</p>",
+                            segment_id=segment.id, **fields)
+        db.session.add(campaign)
+        db.session.commit()
+        return campaign.id
+
+
+def test_staged_campaign_records_schedule_ids(app_module, client):
+    from models import db, Campaign, CampaignDelivery
+
+    campaign_id = create_campaign(
+        app_module, "staged", 20, status="scheduled",
+        scheduled_at=datetime.utcnow() + timedelta(hours=1), delivery_window=3600,
+    )
+    response = client.post(f"/nylas/schedule-campaign/{campaign_id}")
+    job = wait_for_job(client, response.headers["Location"].split("job_id=", 1)[1])
+    assert job["status"] == "succeeded"
+
+    with app_module.app.app_context():
+        assert db.session.get(Campaign, campaign_id).status == "staged"
+        deliveries = CampaignDelivery.query.filter_by(campaign_id=campaign_id).all()
+        assert len(deliveries) == 20
+        assert all(delivery.status == "staged" for delivery in deliveries)
+        assert all(delivery.provider_message_id for delivery in deliveries)
+        assert all(delivery.provider_schedule_id for delivery in deliveries)
+
+
+def test_resuming_exhausted_partial_campaign_settles_it(app_module, client):
+    from models import db, Campaign, CampaignDelivery, Segment
+    from ledger import seed_deliveries
+
+    campaign_id = create_campaign(app_module, "exhausted", 3, status="partial")
+    max_attempts = app_module.app.config["CAMPAIGN_MAX_DELIVERY_ATTEMPTS"]
+    with app_module.app.app_context():
+        campaign = db.session.get(Campaign, campaign_id)
+        seed_deliveries(campaign_id, db.session.get(Segment, campaign.segment_id))
+        CampaignDelivery.query.filter_by(campaign_id=campaign_id).update(
+            {"status": "failed", "attempts": max_attempts}
+        )
+        db.session.commit()
+
+    client.post(f"/nylas/schedule-campaign/{campaign_id}")
+
+    with app_module.app.app_context():
+        assert db.session.get(Campaign, campaign_id).status == "done_with_failures"
+    assert app_module.scheduler.get_job(app_module.campaign_job_id(campaign_id)) is None
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+from nylas import Client
+from nylas.models.errors import NylasApiError, NylasSdkTimeoutError
+
+import resilience
+from fakes import Faults, FakeNylas
+
+
+@pytest.fixture
+def fake_nylas():
+    servers = []
+
+    def start(faults):
+        server = FakeNylas(faults, messages=5, contacts=0).start()
+        servers.append(server)
+        return Client(api_key="test", api_uri=server.url)
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_nylas_429_waits_for_retry_after(fake_nylas, monkeypatch):
+    nylas = fake_nylas(Faults(rate_limit_rate=1.0, retry_after=7))
+    with pytest.raises(NylasApiError) as raised:
+        nylas.messages.find("grant", "msg-1")
+    assert raised.value.status_code == 429
+    assert resilience.retry_after_seconds(raised.value) == 7
+
+    delays = []
+    monkeypatch.setattr(resilience.time, "sleep", lambda seconds: None)
+    with pytest.raises(NylasApiError):
+        resilience.call(
+            lambda timeout: nylas.messages.find("grant", "msg-1", overrides=resilience.nylas_overrides(timeout)),
+            policy=resilience.RetryPolicy(max_attempts=2, deadline=60),
+            on_retry=lambda error, delay: delays.append(delay),
+        )
+    assert delays == [7]
+
+
+def test_attempt_timeout_is_bounded_by_the_deadline(fake_nylas):
+    nylas = fake_nylas(Faults(latency=3))
+    started = time.monotonic()
+    with pytest.raises(NylasSdkTimeoutError):
+        resilience.call(
+            lambda timeout: nylas.messages.find("grant", "msg-1", overrides=resilience.nylas_overrides(timeout)),
+            policy=resilience.RetryPolicy(max_attempts=3, base_delay=0.1, max_delay=0.1, deadline=1),
+        )
+    assert time.monotonic() - started < 2